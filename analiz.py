@@ -0,0 +1,318 @@
+import os
+import json
+import time
+import asyncio
+
+import llm
+import hedge
+import metrics
+import kullanim
+import on_eleme
+from limiter import KapasiteAsimi, model_cagrisi
+from pipeline import Asama, asama_calistir, graf_calistir
+from promptlar import EK_BILGI_PROMPT, GORSEL_PROMPT_ISTEGI, TEK_CAGRI_TALIMATI, ANALIZ_SEMASI, prompt_olustur
+
+# --- ANALİZ MODU ---
+# "zincir": Eski akış (yorum -> "Başlık | Duygu" -> görsel prompt, aynı sohbette 3 çağrı)
+# "tek":    Tek generate_content çağrısı, JSON şemasına uygun cevap
+ANALIZ_MODLARI = ("zincir", "tek")
+ANALIZ_MODU = os.getenv("ANALIZ_MODU", "zincir")
+# Bir analizin (tüm aşamalar + hedge'ler) aşamayacağı toplam süre
+ANALIZ_SON_TARIH_SN = float(os.getenv("ANALIZ_SON_TARIH_SN", "120"))
+# Zincir modunda görsel prompt'u analizle birlikte mi üretilsin? Varsayılan: hayır,
+# görsel ilk istendiğinde (/resim/{id}) gorsel_prompt_uret ile üretilir.
+GORSEL_ONCEDEN = os.getenv("GORSEL_ONCEDEN", "0") == "1"
+
+VARSAYILAN_BASLIK = "Bilinçaltı Mesajı"
+VARSAYILAN_DUYGU = "Nötr"
+
+
+def baslik_duygu_ayristir(ek_metin: str) -> tuple[str, str]:
+    """'Başlık | Duygu' formatındaki cevabı ayırır, olmazsa varsayılanlara düşer."""
+    ruya_basligi = VARSAYILAN_BASLIK
+    ruya_duygusu = VARSAYILAN_DUYGU
+    if "|" in ek_metin:
+        parts = ek_metin.split('|')
+        if len(parts) >= 2:
+            ruya_basligi = parts[0].strip().replace('"', '')
+            ruya_duygusu = parts[1].strip().replace('.', '')
+    elif ek_metin:
+        ruya_basligi = ek_metin
+    return ruya_basligi, ruya_duygusu
+
+
+def _girdi_token(response) -> int:
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "prompt_token_count", 0) or 0
+
+
+def _asama_ayari(ad: str, zaman_asimi: float, deneme: int) -> dict:
+    """Aşama zaman aşımı ve deneme sayısı ortamdan değiştirilebilir (örn. ASAMA_YORUM_ZAMAN_ASIMI_SN)."""
+    return {
+        "zaman_asimi": float(os.getenv(f"ASAMA_{ad.upper()}_ZAMAN_ASIMI_SN", zaman_asimi)),
+        "deneme": int(os.getenv(f"ASAMA_{ad.upper()}_DENEME", deneme)),
+        # Sınırlayıcı/devre kesici reddi yeniden denenmez, hemen 429/503 olarak döner
+        "denenmeyecek": (KapasiteAsimi,),
+    }
+
+
+# ==========================================
+#              ANALİZ AŞAMALARI
+# ==========================================
+# Zincir modu grafiği:  yorum -> baslik_duygu (GORSEL_ONCEDEN ise paralel gorsel) -> kaydet
+# Tek çağrı modu:       tek -> kaydet
+
+def _rota_kaydet(baglam: dict, asama: str, model, gecikme_ms: float, sonuc: str, response=None) -> None:
+    """Kullanım satırı + rota (üyelik, aşama, model) başına gecikme dağılımı."""
+    kullanim.kaydet(baglam, asama, model.model_name, gecikme_ms, sonuc, response)
+    if sonuc == "basarili":
+        metrics.gozlem(f"rota_gecikme_ms.{baglam['uyelik']}.{asama}.{model.model_name}", gecikme_ms)
+
+
+async def _model_cagir(baglam: dict, asama: str, cagri):
+    """cagri(model): rotanın modeline tek bir istek atan coroutine fabrikası.
+
+    Her deneme sınırlayıcı/devre kesiciden geçer; yavaş kalan çağrı için
+    bütçe ve son tarih elverirse ikinci (hedge) istek atılır.
+    """
+    model = baglam["modeller"][asama]
+    metrics.artir(f"rota_secimi.{baglam['uyelik']}.{asama}.{model.model_name}")
+
+    async def _sinirli():
+        async with model_cagrisi(baglam["uyelik"], asama, baglam.get("tahmini_token")):
+            baslangic = time.perf_counter()
+            try:
+                sonuc = await cagri(model)
+            except asyncio.CancelledError:
+                _rota_kaydet(baglam, asama, model, (time.perf_counter() - baslangic) * 1000, "iptal")
+                raise
+            except Exception as e:
+                _rota_kaydet(baglam, asama, model, (time.perf_counter() - baslangic) * 1000, "hata")
+                llm.hata_bildir(model, e)
+                raise
+            response = sonuc[1] if isinstance(sonuc, tuple) else sonuc
+            _rota_kaydet(baglam, asama, model, (time.perf_counter() - baslangic) * 1000, "basarili", response)
+            return sonuc
+    return await hedge.hedge_ile(f"{asama}.{baglam['uyelik']}", _sinirli, baglam.get("son_tarih"))
+
+
+async def yorum_asamasi(baglam: dict) -> dict:
+    async def _cagri(model):
+        # Hedge iki istek atabileceği için her istek kendi sohbetini açar
+        chat = model.start_chat(history=[])
+        return chat, await chat.send_message_async(baglam["prompt"])
+    chat, response = await _model_cagir(baglam, "yorum", _cagri)
+    return {"yorum": response.text, "gecmis": chat.history, "girdi_token": _girdi_token(response)}
+
+
+async def _devam_mesaji(baglam: dict, asama: str, mesaj: str):
+    """Yorum sohbetinin bir kopyası üzerinden takip sorusu (zenginleştirme aşamaları paralel çalışabilir).
+
+    Sohbet geçmişi aşamanın kendi rotasındaki modele (genelde daha hafif) taşınır.
+    """
+    async def _cagri(model):
+        chat = model.start_chat(history=baglam["yorum"]["gecmis"])
+        return await chat.send_message_async(mesaj)
+    return await _model_cagir(baglam, asama, _cagri)
+
+
+async def baslik_duygu_asamasi(baglam: dict) -> dict:
+    response = await _devam_mesaji(baglam, "baslik_duygu", EK_BILGI_PROMPT)
+    ruya_basligi, ruya_duygusu = baslik_duygu_ayristir(response.text.strip())
+    return {"baslik": ruya_basligi, "duygu": ruya_duygusu, "girdi_token": _girdi_token(response)}
+
+
+async def gorsel_asamasi(baglam: dict) -> dict:
+    response = await _devam_mesaji(baglam, "gorsel", GORSEL_PROMPT_ISTEGI)
+    return {"gorsel_prompt": response.text.strip(), "girdi_token": _girdi_token(response)}
+
+
+async def tek_cagri_asamasi(baglam: dict) -> dict:
+    """Tek generate_content çağrısı; cevap ANALIZ_SEMASI'na uygun JSON olarak gelir."""
+    # Token sınırı "tek" rotasında (yorum sınırı + başlık/duygu/görsel payı)
+    response = await _model_cagir(baglam, "tek", lambda model: model.generate_content_async(
+        baglam["prompt"] + TEK_CAGRI_TALIMATI,
+        generation_config={
+            "response_mime_type": "application/json",
+            "response_schema": ANALIZ_SEMASI,
+        },
+    ))
+    veri = json.loads(response.text)
+
+    return {
+        "yorum": veri["yorum"],
+        "baslik": veri.get("baslik", "").strip().replace('"', '') or VARSAYILAN_BASLIK,
+        "duygu": veri.get("duygu", "").strip().replace('.', '') or VARSAYILAN_DUYGU,
+        "gorsel_prompt": veri.get("gorsel_prompt", "").strip(),
+        "girdi_token": _girdi_token(response),
+    }
+
+
+YORUM_ASAMASI = Asama("yorum", yorum_asamasi, **_asama_ayari("yorum", 60, 2))
+GORSEL_ASAMASI = Asama("gorsel", gorsel_asamasi, bagimliliklar=("yorum",), **_asama_ayari("gorsel", 20, 2))
+ZENGINLESTIRME_ASAMALARI = [
+    Asama("baslik_duygu", baslik_duygu_asamasi, bagimliliklar=("yorum",), **_asama_ayari("baslik_duygu", 20, 2)),
+    *([GORSEL_ASAMASI] if GORSEL_ONCEDEN else []),
+]
+TEK_CAGRI_ASAMASI = Asama("tek", tek_cagri_asamasi, **_asama_ayari("tek", 90, 2))
+KAYDET_AYARI = _asama_ayari("kaydet", 10, 1)
+
+
+def sonuc_birlestir(baglam: dict) -> dict:
+    """Aşama çıktılarını tek sonuç sözlüğünde toplar (girdi_token'lar toplanır)."""
+    sonuc = {"girdi_token": 0}
+    for ad in ("yorum", "tek", "baslik_duygu", "gorsel"):
+        cikti = baglam.get(ad)
+        if not cikti:
+            continue
+        for anahtar, deger in cikti.items():
+            if anahtar == "girdi_token":
+                sonuc["girdi_token"] += deger
+            elif anahtar != "gecmis":
+                sonuc[anahtar] = deger
+    return sonuc
+
+
+def baglam_olustur(profil: dict, ruya_metni: str) -> dict:
+    """Grafın ortak girdileri: aşama başına rota modeli ve istek başına kısa prompt.
+
+    tahmini_token (prompt'un ucuz token tahmini) kullanım kaydına ve sınırlayıcının
+    maliyet ağırlığına gider.
+    """
+    prompt = prompt_olustur(profil["zodiac"], ruya_metni)
+    return {
+        "modeller": {
+            asama: llm.model_getir(profil["interpreter_type"], profil["is_premium"], asama)
+            for asama in llm.ASAMALAR
+        },
+        "user_id": profil.get("user_id"),
+        "yorumcu": profil["interpreter_type"],
+        "uyelik": llm.uyelik(profil["is_premium"]),
+        "prompt": prompt,
+        "tahmini_token": on_eleme.token_tahmini(prompt),
+        "son_tarih": time.monotonic() + ANALIZ_SON_TARIH_SN,
+    }
+
+
+def _kaydet_asamasi(kaydet, sonraki: tuple[str, ...]) -> Asama:
+    """kaydet(sonuc) geri çağrısını grafın son aşaması olarak sarar (yeniden denenmez)."""
+    async def _kaydet(baglam: dict):
+        return await kaydet(sonuc_birlestir(baglam))
+    return Asama("kaydet", _kaydet, bagimliliklar=sonraki, **KAYDET_AYARI)
+
+
+async def analiz_calistir(profil: dict, ruya_metni: str, mod: str | None = None, kaydet=None) -> dict:
+    """Seçilen moda göre aşama grafiğini çalıştırır.
+
+    kaydet verilirse (async, sonuc -> kayıt bilgisi) grafın son aşaması olarak
+    çağrılır ve dönüşü sonuc["kayit"] içine konur.
+    """
+    mod = mod or ANALIZ_MODU
+    if mod not in ANALIZ_MODLARI:
+        raise ValueError(f"Geçersiz analiz modu: {mod}")
+
+    if mod == "tek":
+        asamalar = [TEK_CAGRI_ASAMASI]
+    else:
+        asamalar = [YORUM_ASAMASI, *ZENGINLESTIRME_ASAMALARI]
+    if kaydet:
+        asamalar.append(_kaydet_asamasi(kaydet, tuple(a.ad for a in asamalar)))
+
+    baslangic = time.perf_counter()
+    baglam = await graf_calistir(asamalar, baglam_olustur(profil, ruya_metni))
+    sure_ms = (time.perf_counter() - baslangic) * 1000
+
+    sonuc = sonuc_birlestir(baglam)
+    sonuc["kayit"] = baglam.get("kaydet")
+
+    # Modları karşılaştırabilmek için süre ve girdi token sayısını logluyoruz
+    print(f"⏱️ Analiz modu={mod} süre={sure_ms:.0f}ms girdi_token={sonuc['girdi_token']}")
+    metrics.gozlem(f"analiz_suresi_ms.{mod}", sure_ms)
+    metrics.artir(f"analiz_girdi_token.{mod}", sonuc["girdi_token"])
+    sonuc["mod"] = mod
+    return sonuc
+
+
+async def zincirleme_analiz_akis(profil: dict, ruya_metni: str, kaydet=None):
+    """Zincir modunun akışlı hali.
+
+    Yorum parçaları geldikçe ("parca", metin) verir; zenginleştirme aşamaları
+    (paralel) ve kayıt tamamlanınca en son ("sonuc", dict) verir. Yorum
+    akışı kısmen gönderildiği için yeniden denenmez.
+    """
+    baslangic = time.perf_counter()
+    baglam = baglam_olustur(profil, ruya_metni)
+    model = baglam["modeller"]["yorum"]
+    metrics.artir(f"rota_secimi.{baglam['uyelik']}.yorum_akis.{model.model_name}")
+    chat = model.start_chat(history=[])
+
+    # Üst akış ayrı bir görevde okunur ve parçalar kuyruğa yazılır: sınırlayıcı
+    # yeri, AIMD gecikmesi ve devre sonucu Gemini akışı bitince kapanır; yavaş
+    # okuyan SSE istemcisi yeri tutmaz, gecikmeyi şişirmez.
+    parcalar = []
+    kuyruk: asyncio.Queue = asyncio.Queue()
+    bitti = object()
+
+    async def _ust_akisi_oku():
+        durum = "iptal"
+        response = None
+        try:
+            async with model_cagrisi(baglam["uyelik"], "yorum_akis", baglam.get("tahmini_token")):
+                try:
+                    response = await chat.send_message_async(baglam["prompt"], stream=True)
+                    async for chunk in response:
+                        if not parcalar:
+                            metrics.gozlem("akis_ilk_parca_ms", (time.perf_counter() - baslangic) * 1000)
+                        parcalar.append(chunk.text)
+                        kuyruk.put_nowait(chunk.text)
+                    durum = "basarili"
+                except Exception as e:
+                    durum = "hata"
+                    llm.hata_bildir(model, e)
+                    raise
+                finally:
+                    _rota_kaydet(baglam, "yorum_akis", model, (time.perf_counter() - baslangic) * 1000, durum,
+                                 response if durum == "basarili" else None)
+            metrics.gozlem("asama_suresi_ms.yorum", (time.perf_counter() - baslangic) * 1000)
+            return response
+        finally:
+            kuyruk.put_nowait(bitti)
+
+    okuyucu = asyncio.create_task(_ust_akisi_oku())
+    try:
+        while (parca := await kuyruk.get()) is not bitti:
+            yield "parca", parca
+        response = await okuyucu
+    finally:
+        if not okuyucu.done():
+            # İstemci koptu: üst akışı da bırak
+            okuyucu.cancel()
+        elif not okuyucu.cancelled():
+            okuyucu.exception()
+
+    baglam["yorum"] = {"yorum": "".join(parcalar), "gecmis": chat.history, "girdi_token": _girdi_token(response)}
+    asamalar = list(ZENGINLESTIRME_ASAMALARI)
+    if kaydet:
+        asamalar.append(_kaydet_asamasi(kaydet, tuple(a.ad for a in asamalar)))
+    await graf_calistir(asamalar, baglam)
+
+    metrics.gozlem("analiz_suresi_ms.akis", (time.perf_counter() - baslangic) * 1000)
+    sonuc = sonuc_birlestir(baglam)
+    sonuc["kayit"] = baglam.get("kaydet")
+    sonuc["mod"] = "akis"
+    yield "sonuc", sonuc
+
+
+async def gorsel_prompt_uret(profil: dict, ruya_metni: str, yorum: str) -> str:
+    """Kayıtlı rüya ve yorumdan görsel prompt'unu üretir (tembel üretim, /resim/{id}).
+
+    Yorum sohbetinin geçmişi kayıttan yeniden kurulur; gorsel aşaması analizdeki
+    ile aynıdır (rota, sınırlayıcı, hedge, yeniden deneme).
+    """
+    baglam = baglam_olustur(profil, ruya_metni)
+    baglam["yorum"] = {"gecmis": [
+        {"role": "user", "parts": [baglam["prompt"]]},
+        {"role": "model", "parts": [yorum]},
+    ]}
+    sonuc = await asama_calistir(GORSEL_ASAMASI, baglam)
+    return sonuc["gorsel_prompt"]
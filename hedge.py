@@ -0,0 +1,78 @@
+import os
+import time
+import asyncio
+
+import metrics
+
+# --- HEDGE (YEDEK) İSTEKLER ---
+# Bir model çağrısı kendi türünün gözlenen HEDGE_YUZDELIK gecikmesini (örn. p90)
+# aştıysa aynı istek ikinci kez atılır; önce dönen kazanır, diğeri iptal edilir.
+# Bütçe: her normal çağrı HEDGE_BUTCE_ORANI kadar jeton biriktirir, her hedge
+# bir jeton harcar (uzun vadede en fazla %5 ek çağrı). İsteğin genel son
+# tarihine yetmeyecek hedge'ler atılmaz.
+
+HEDGE_AKTIF = os.getenv("HEDGE_AKTIF", "1") == "1"
+HEDGE_YUZDELIK = float(os.getenv("HEDGE_YUZDELIK", "0.9"))
+HEDGE_BUTCE_ORANI = float(os.getenv("HEDGE_BUTCE_ORANI", "0.05"))
+HEDGE_BUTCE_TAVANI = float(os.getenv("HEDGE_BUTCE_TAVANI", "10"))
+HEDGE_EN_AZ_GOZLEM = int(os.getenv("HEDGE_EN_AZ_GOZLEM", "20"))
+
+_butce = 0.0
+
+
+def _esik_ms(tur: str) -> float | None:
+    if metrics.gozlem_sayisi(f"model_gecikme_ms.{tur}") < HEDGE_EN_AZ_GOZLEM:
+        return None
+    return metrics.yuzdelik(f"model_gecikme_ms.{tur}", HEDGE_YUZDELIK)
+
+
+async def hedge_ile(tur: str, cagri, son_tarih: float | None = None):
+    """cagri: her çağrıldığında yeni bir istek atan coroutine fabrikası."""
+    global _butce
+    _butce = min(HEDGE_BUTCE_TAVANI, _butce + HEDGE_BUTCE_ORANI)
+
+    baslangic = time.perf_counter()
+    birinci = asyncio.create_task(cagri())
+    esik = _esik_ms(tur) if HEDGE_AKTIF else None
+
+    try:
+        if esik is not None:
+            done, _ = await asyncio.wait({birinci}, timeout=esik / 1000)
+            if not done:
+                kalan = son_tarih - time.monotonic() if son_tarih else None
+                if kalan is not None and kalan * 1000 < esik:
+                    metrics.artir(f"hedge_atlandi_son_tarih.{tur}")
+                elif _butce < 1:
+                    metrics.artir(f"hedge_atlandi_butce.{tur}")
+                else:
+                    _butce -= 1
+                    metrics.artir(f"hedge_atildi.{tur}")
+                    sonuc, kazanan = await _ilk_basarili(birinci, asyncio.create_task(cagri()))
+                    if kazanan == 1:
+                        metrics.artir(f"hedge_kazandi.{tur}")
+                    metrics.gozlem(f"model_gecikme_ms.{tur}", (time.perf_counter() - baslangic) * 1000)
+                    return sonuc
+
+        sonuc = await birinci
+        metrics.gozlem(f"model_gecikme_ms.{tur}", (time.perf_counter() - baslangic) * 1000)
+        return sonuc
+    finally:
+        if not birinci.done():
+            birinci.cancel()
+
+
+async def _ilk_basarili(birinci: asyncio.Task, ikinci: asyncio.Task):
+    """İlk başarılı sonucu ve kazananın sırasını (0/1) döner; ikisi de hata verirse ilkinin hatası fırlar."""
+    gorevler = [birinci, ikinci]
+    bekleyenler = set(gorevler)
+    try:
+        while bekleyenler:
+            done, bekleyenler = await asyncio.wait(bekleyenler, return_when=asyncio.FIRST_COMPLETED)
+            for gorev in done:
+                if gorev.exception() is None:
+                    return gorev.result(), gorevler.index(gorev)
+        return await birinci  # ikisi de hatalı
+    finally:
+        for gorev in gorevler:
+            if not gorev.done():
+                gorev.cancel()
@@ -0,0 +1,245 @@
+import os
+import json
+import uuid
+import asyncio
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+
+import models
+import metrics
+from analiz import ANALIZ_SON_TARIH_SN
+from database import db_calistir
+from tek_ucus import TEK_UCUS_KIRA_SN
+
+# --- ANALİZ İŞLERİ (JOB MODU) ---
+# İşler 'analiz_isleri' tablosunda tutulur (SQLite/Postgres aynı engine).
+# Her worker'da IS_ISCI_SAYISI kadar asyncio işçisi süreç içi kuyruktan iş id'si
+# alır; iş, koşullu UPDATE (bekliyor -> calisiyor) ile sahiplenildiği için iki
+# worker aynı işi çalıştırmaz. Yeniden başlatmada bekleyen işler kuyruğa geri alınır.
+# Kapanışta yarıda kalan iş 'bekliyor'a döner; çöken worker'ın işi IS_TAKILMA_SN
+# sonra (başlangıçta ve periyodik temizlikte) yeniden kuyruğa alınır.
+# Kuyruğa sığmayan işler taşma listesinde bekler, işçiler yer açıldıkça alır;
+# periyodik temizlik IS_TAKILMA_SN'den uzun bekleyen (kuyruğu ölen worker'da
+# kalmış olabilecek) işleri de yeniden ekler. Aynı iş iki kez kuyruğa girse de
+# sahiplenme koşullu olduğu için bir kez çalışır. Biten işler IS_SAKLAMA_SN sonra silinir.
+
+IS_ISCI_SAYISI = int(os.getenv("IS_ISCI_SAYISI", "4"))
+IS_KUYRUK_LIMITI = int(os.getenv("IS_KUYRUK_LIMITI", "500"))
+# Bir iş en çok tek uçuş kirasını bekler (başka worker aynı analizi yapıyorsa) ve
+# sonra analiz son tarihine kadar çalışır; bundan uzun 'calisiyor' kalan işin sahibi yok demektir
+IS_TAKILMA_SN = float(os.getenv("IS_TAKILMA_SN", str(TEK_UCUS_KIRA_SN + ANALIZ_SON_TARIH_SN + 60)))
+# Biten (tamamlandi/hata) iş sonucu bu kadar sorgulanabilir, sonra periyodik temizlikte silinir
+IS_SAKLAMA_SN = float(os.getenv("IS_SAKLAMA_SN", str(7 * 24 * 3600)))
+
+BEKLIYOR = "bekliyor"
+CALISIYOR = "calisiyor"
+TAMAMLANDI = "tamamlandi"
+HATA = "hata"
+
+_kuyruk: asyncio.Queue | None = None
+_kuyrukta: set[str] = set()  # kuyrukta bekleyen id'ler (aynı işi iki kez eklememek için)
+_tasan: dict[str, None] = {}  # kuyruk doluyken eklenemeyenler, sırayla (sıralı küme)
+_isciler: list[asyncio.Task] = []
+_calistirici = None
+_calisan = 0
+
+
+def _is_olustur(db, user_id: str, istek: dict) -> str:
+    is_id = uuid.uuid4().hex
+    db.add(models.AnalizIsi(id=is_id, user_id=user_id, durum=BEKLIYOR, istek=json.dumps(istek, ensure_ascii=False)))
+    db.commit()
+    return is_id
+
+
+def _is_sahiplen(db, is_id: str) -> dict | None:
+    """İşi 'calisiyor' durumuna alır; başka bir işçi almışsa None döner."""
+    simdi = datetime.utcnow()
+    alindi = db.query(models.AnalizIsi).filter(
+        models.AnalizIsi.id == is_id,
+        models.AnalizIsi.durum == BEKLIYOR,
+    ).update({"durum": CALISIYOR, "baslama": simdi}, synchronize_session=False)
+    db.commit()
+    if alindi != 1:
+        return None
+    is_kaydi = db.query(models.AnalizIsi).filter(models.AnalizIsi.id == is_id).first()
+    return {
+        "istek": json.loads(is_kaydi.istek),
+        "bekleme_ms": (simdi - is_kaydi.olusturma).total_seconds() * 1000,
+    }
+
+
+def _is_bitir(db, is_id: str, durum: str, sonuc: dict | None = None, hata: dict | None = None) -> None:
+    db.query(models.AnalizIsi).filter(models.AnalizIsi.id == is_id).update({
+        "durum": durum,
+        "sonuc": json.dumps(sonuc, ensure_ascii=False) if sonuc is not None else None,
+        "hata": json.dumps(hata, ensure_ascii=False) if hata is not None else None,
+        "bitis": datetime.utcnow(),
+    }, synchronize_session=False)
+    db.commit()
+
+
+def _is_geri_al(db, is_id: str) -> None:
+    db.query(models.AnalizIsi).filter(
+        models.AnalizIsi.id == is_id,
+        models.AnalizIsi.durum == CALISIYOR,
+    ).update({"durum": BEKLIYOR, "baslama": None}, synchronize_session=False)
+    db.commit()
+
+
+def _takilanlari_geri_al(db) -> list[str]:
+    """Sahibi kapanmadan ölmüş (çökme, kill) 'calisiyor' işleri 'bekliyor'a döndürür; geri alınan id'ler."""
+    sinir = datetime.utcnow() - timedelta(seconds=IS_TAKILMA_SN)
+    kosul = (models.AnalizIsi.durum == CALISIYOR, models.AnalizIsi.baslama < sinir)
+    geri_alinan = []
+    for (is_id,) in db.query(models.AnalizIsi.id).filter(*kosul).all():
+        # Koşullu: başka worker aynı anda geri aldıysa ikimiz birden kuyruğa eklemeyelim
+        if db.query(models.AnalizIsi).filter(models.AnalizIsi.id == is_id, *kosul).update(
+            {"durum": BEKLIYOR, "baslama": None}, synchronize_session=False
+        ) == 1:
+            geri_alinan.append(is_id)
+    db.commit()
+    if geri_alinan:
+        metrics.artir("is_takilan_geri_alinan", len(geri_alinan))
+    return geri_alinan
+
+
+def eski_isleri_temizle(db) -> int:
+    sinir = datetime.utcnow() - timedelta(seconds=IS_SAKLAMA_SN)
+    silinen = db.query(models.AnalizIsi).filter(
+        models.AnalizIsi.durum.in_((TAMAMLANDI, HATA)),
+        models.AnalizIsi.bitis < sinir,
+    ).delete(synchronize_session=False)
+    db.commit()
+    if silinen:
+        metrics.artir("is_silinen", silinen)
+    return silinen
+
+
+def _bekleyenleri_getir(db, en_yeni: datetime | None = None) -> list[str]:
+    """Takılanları geri alıp 'bekliyor' işleri sırayla döner (en_yeni: yalnızca bundan önce oluşturulanlar)."""
+    geri_alinan = _takilanlari_geri_al(db)
+    sorgu = db.query(models.AnalizIsi.id).filter(models.AnalizIsi.durum == BEKLIYOR)
+    if en_yeni is not None:
+        sorgu = sorgu.filter(models.AnalizIsi.olusturma < en_yeni)
+    kayitlar = sorgu.order_by(models.AnalizIsi.olusturma).all()
+    return list(dict.fromkeys(geri_alinan + [kayit.id for kayit in kayitlar]))
+
+
+def is_getir(db, is_id: str) -> dict | None:
+    is_kaydi = db.query(models.AnalizIsi).filter(models.AnalizIsi.id == is_id).first()
+    if not is_kaydi:
+        return None
+    cevap = {"job_id": is_kaydi.id, "durum": is_kaydi.durum}
+    if is_kaydi.sonuc:
+        cevap["sonuc"] = json.loads(is_kaydi.sonuc)
+    if is_kaydi.hata:
+        cevap["hata"] = json.loads(is_kaydi.hata)
+    return cevap
+
+
+def _kuyruk_metrigi() -> None:
+    metrics.ayarla("is_kuyruk_derinligi", _kuyruk.qsize())
+    metrics.ayarla("is_calisan", _calisan)
+
+
+async def gonder(user_id: str, istek: dict) -> str:
+    if _kuyruk is None:
+        raise HTTPException(status_code=503, detail="İş kuyruğu çalışmıyor")
+    if _kuyruk.full():
+        metrics.artir("is_reddedilen")
+        raise HTTPException(status_code=503, detail="İş kuyruğu dolu")
+
+    is_id = await db_calistir(_is_olustur, user_id, istek)
+    _kuyrukta.add(is_id)
+    _kuyruk.put_nowait(is_id)
+    metrics.artir("is_olusturulan")
+    _kuyruk_metrigi()
+    return is_id
+
+
+async def _isci():
+    global _calisan
+    while True:
+        is_id = await _kuyruk.get()
+        _kuyrukta.discard(is_id)
+        _tasandan_doldur()
+        try:
+            sahiplenilen = await db_calistir(_is_sahiplen, is_id)
+            if sahiplenilen is None:
+                continue
+            metrics.gozlem("is_bekleme_ms", sahiplenilen["bekleme_ms"])
+
+            _calisan += 1
+            _kuyruk_metrigi()
+            try:
+                with metrics.sure_olc("is_calisma_ms"):
+                    sonuc = await _calistirici(sahiplenilen["istek"])
+                await db_calistir(_is_bitir, is_id, TAMAMLANDI, sonuc)
+                metrics.artir("is_tamamlanan")
+            except asyncio.CancelledError:
+                # Kapanış: iş yarıda kaldı (kota analizde iade edildi); sonraki başlangıçta yeniden çalışsın
+                await asyncio.shield(db_calistir(_is_geri_al, is_id))
+                metrics.artir("is_geri_alinan")
+                raise
+            except HTTPException as he:
+                await db_calistir(_is_bitir, is_id, HATA, None, {"status_code": he.status_code, "detail": he.detail})
+                metrics.artir("is_hatali")
+            except Exception as e:
+                print(f"İş Hatası ({is_id}): {e}")
+                await db_calistir(_is_bitir, is_id, HATA, None, {"status_code": 500, "detail": f"Sunucu hatası: {str(e)}"})
+                metrics.artir("is_hatali")
+            finally:
+                _calisan -= 1
+                _kuyruk_metrigi()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ İş işçisi hatası ({is_id}): {e}")
+        finally:
+            _kuyruk.task_done()
+
+
+async def baslat(calistirici) -> None:
+    """calistirici: async (istek dict) -> sonuç dict."""
+    global _kuyruk, _calistirici
+    _calistirici = calistirici
+    _kuyruk = asyncio.Queue(maxsize=IS_KUYRUK_LIMITI)
+    _isciler.extend(asyncio.create_task(_isci()) for _ in range(IS_ISCI_SAYISI))
+
+    # Önceki çalışmadan kalan bekleyen (ve takılıp geri alınan) işler
+    _kuyruga_ekle(await db_calistir(_bekleyenleri_getir))
+
+
+def _tasandan_doldur() -> None:
+    while _tasan and not _kuyruk.full():
+        is_id = next(iter(_tasan))
+        del _tasan[is_id]
+        _kuyrukta.add(is_id)
+        _kuyruk.put_nowait(is_id)
+    metrics.ayarla("is_tasan", len(_tasan))
+    _kuyruk_metrigi()
+
+
+def _kuyruga_ekle(is_idleri: list[str]) -> None:
+    """Kuyruğa sığanı ekler, kalanı taşma listesine; zaten kuyrukta/listede olanı atlar."""
+    for is_id in is_idleri:
+        if is_id not in _kuyrukta:
+            _tasan.setdefault(is_id)
+    _tasandan_doldur()
+
+
+async def takilanlari_kuyruga_al() -> None:
+    """Çöken worker'ların işlerini geri alır; onlarla birlikte uzun süredir bekleyenleri kuyruğa ekler (periyodik)."""
+    if _kuyruk is not None:
+        en_yeni = datetime.utcnow() - timedelta(seconds=IS_TAKILMA_SN)
+        _kuyruga_ekle(await db_calistir(_bekleyenleri_getir, en_yeni))
+
+
+async def durdur() -> None:
+    for isci in _isciler:
+        isci.cancel()
+    await asyncio.gather(*_isciler, return_exceptions=True)
+    _isciler.clear()
+    _kuyrukta.clear()
+    _tasan.clear()
@@ -0,0 +1,310 @@
+import os
+import json
+import math
+import time
+import hashlib
+import urllib.parse
+from dataclasses import dataclass
+
+from cachetools import TTLCache
+from sqlalchemy import case, update
+from sqlalchemy.exc import IntegrityError
+from starlette.responses import JSONResponse
+
+import models
+import metrics
+from database import db_calistir
+
+# --- İSTEK SINIRI (token bucket, ASGI middleware) ---
+# Her endpoint grubunun (kural) kullanıcı (user_id), istemci IP'si, yol (kaynak
+# başına, örn. /resim/{id}) ve isteğe bağlı genel (tüm istemciler) kovaları vardır. Kova 'kapasite' jetonla dolu başlar ve
+# dakikada 'dakikada' jeton dolar; her istek ilgili her kovadan 1 jeton harcar.
+# Kovalardan biri boşsa istek 429 + Retry-After ile döner: gövde doğrulanmadan,
+# DB oturumu açılmadan ve kota kontrolüne gelmeden. Bir kova boşsa diğerlerinden
+# de jeton düşülmez (hep ya da hiç).
+#
+# Depo (ISTEK_SINIRI_DEPO):
+#   bellek: süreç içi; her uvicorn worker'ının kendi kovaları olur
+#   db:     'istek_kovalari' tablosu; tüm worker'lar aynı kovaları paylaşır
+#           (istek başına bir kısa işlem; DB hatasında istek geçirilir)
+#
+# user_id istemcinin gönderdiği bir değerdir: kullanıcı kovası adil paylaşım
+# içindir, kötüye kullanıma karşı asıl koruma IP kovasıdır.
+#
+# IP kovaları isteğe bağlıdır (ISTEK_SINIRI_IP=1): proxy arkasında (Render) soket
+# karşısı proxy'dir ve tüm kullanıcılar tek kovayı paylaşırdı. Açmadan önce gerçek
+# istemci IP'si görünür olmalı:
+#   uvicorn main:app --proxy-headers --forwarded-allow-ips='*'   (ya da FORWARDED_ALLOW_IPS='*')
+# ile scope["client"] X-Forwarded-For'dan gelir; ya da ISTEK_SINIRI_XFF=1 ile başlığın
+# son halkası doğrudan okunur. Proxy yoksa XFF açılmamalı (istemci başlığı kendi yazar).
+# IP kapalıyken user_id taşımayan /jobs ve /resim yalnızca yol (aynı iş/rüya
+# kimliğini dövmeye karşı) ve genel (toplam) kovalarıyla sınırlanır.
+# Kurallar ISTEK_SINIRLARI (JSON) ile kural bazında ezilebilir, örn.:
+#   ISTEK_SINIRLARI='{"analiz": {"kullanici": [3, 6]}, "saglik": {"yollar": ["/health"], "ip": [10, 60]}}'
+
+ISTEK_SINIRI_AKTIF = os.getenv("ISTEK_SINIRI_AKTIF", "1") == "1"
+ISTEK_SINIRI_DEPO = os.getenv("ISTEK_SINIRI_DEPO", "bellek")
+ISTEK_SINIRI_IP = os.getenv("ISTEK_SINIRI_IP", "0") == "1"
+# Render gibi bir proxy arkasında istemci IP'si X-Forwarded-For'un son halkasıdır
+ISTEK_SINIRI_XFF = os.getenv("ISTEK_SINIRI_XFF", "0") == "1"
+# user_id için JSON gövdesi en fazla bu boyuta kadar okunur (daha büyükse sadece IP kovası)
+ISTEK_SINIRI_GOVDE_EN_COK = int(os.getenv("ISTEK_SINIRI_GOVDE_EN_COK", str(256 * 1024)))
+# Bu süre dokunulmayan kova (çoktan dolmuştur) bellekten/tablodan atılır
+ISTEK_SINIRI_KOVA_OMRU_SN = float(os.getenv("ISTEK_SINIRI_KOVA_OMRU_SN", "3600"))
+ISTEK_SINIRI_BELLEK_BOYUT = int(os.getenv("ISTEK_SINIRI_BELLEK_BOYUT", "100000"))
+
+KAPSAMLAR = ("kullanici", "ip", "yol", "genel")
+
+# kural -> yol önekleri + kapsam başına [kapasite, dakikada]; kapasite 0: o kapsam kapalı
+VARSAYILAN_KURALLAR = {
+    "analiz": {"yollar": ["/analiz-et"], "kullanici": [5, 10], "ip": [20, 60], "genel": [0, 0]},
+    "gecmis": {"yollar": ["/gecmis"], "kullanici": [20, 60], "ip": [60, 300]},
+    "ruya": {"yollar": ["/ruya"], "kullanici": [60, 300], "ip": [120, 600]},
+    "profil_oku": {"yollar": ["/get-profile"], "yolda_kullanici": True, "kullanici": [20, 60], "ip": [60, 300]},
+    "profil_yaz": {"yollar": ["/set-profile", "/set-premium"], "kullanici": [10, 30], "ip": [30, 120]},
+    "is_durumu": {"yollar": ["/jobs"], "ip": [120, 600], "yol": [30, 120], "genel": [600, 3000]},
+    "resim": {"yollar": ["/resim"], "ip": [120, 600], "yol": [20, 60], "genel": [300, 1200]},
+}
+
+
+@dataclass
+class Kural:
+    ad: str
+    yollar: tuple[str, ...]
+    kovalar: dict[str, tuple[float, float]]  # kapsam -> (kapasite, dakikada)
+    yolda_kullanici: bool = False  # user_id yolun son parçası (/get-profile/{user_id})
+
+    def eslesir(self, yol: str) -> bool:
+        return any(yol == onek or yol.startswith(onek + "/") for onek in self.yollar)
+
+
+def _kurallari_yukle() -> list[Kural]:
+    ayarlar = {ad: dict(kural) for ad, kural in VARSAYILAN_KURALLAR.items()}
+    for ad, ezme in json.loads(os.getenv("ISTEK_SINIRLARI", "{}")).items():
+        ayarlar.setdefault(ad, {"yollar": []}).update(ezme)
+
+    kurallar = []
+    for ad, ayar in ayarlar.items():
+        kovalar = {
+            kapsam: (float(ayar[kapsam][0]), float(ayar[kapsam][1]))
+            for kapsam in KAPSAMLAR
+            if ayar.get(kapsam) and ayar[kapsam][0] > 0 and (kapsam != "ip" or ISTEK_SINIRI_IP)
+        }
+        yollar = tuple(onek.rstrip("/") for onek in ayar["yollar"])
+        kurallar.append(Kural(ad, yollar, kovalar, bool(ayar.get("yolda_kullanici"))))
+    return kurallar
+
+
+KURALLAR = _kurallari_yukle()
+
+
+def kural_bul(yol: str) -> Kural | None:
+    return next((kural for kural in KURALLAR if kural.eslesir(yol)), None)
+
+
+def kova_hesapla(jeton: float, son: float, kapasite: float, dakikada: float, simdi: float) -> tuple[float, float]:
+    """Dolumdan sonraki jeton sayısı ve bir jeton için beklenecek süre (sn, 0: hemen)."""
+    hiz = dakikada / 60
+    jeton = min(kapasite, jeton + max(0.0, simdi - son) * hiz)
+    if jeton >= 1:
+        return jeton, 0.0
+    return jeton, (1 - jeton) / hiz if hiz > 0 else ISTEK_SINIRI_KOVA_OMRU_SN
+
+
+# Kova: (kapsam, anahtar, kapasite, dakikada). harca() -> (bekleme sn, engelleyen kapsam)
+
+class BellekDepo:
+    ad = "bellek"
+
+    def __init__(self):
+        self._kovalar = TTLCache(maxsize=ISTEK_SINIRI_BELLEK_BOYUT, ttl=ISTEK_SINIRI_KOVA_OMRU_SN)
+
+    async def harca(self, kovalar: list[tuple]) -> tuple[float, str | None]:
+        # Arada await yok: olay döngüsünde hep ya da hiç atomik
+        simdi = time.monotonic()
+        yeni = []
+        for kapsam, anahtar, kapasite, dakikada in kovalar:
+            jeton, son = self._kovalar.get(anahtar, (kapasite, simdi))
+            jeton, bekleme = kova_hesapla(jeton, son, kapasite, dakikada, simdi)
+            if bekleme:
+                return bekleme, kapsam
+            yeni.append((anahtar, jeton))
+        for anahtar, jeton in yeni:
+            self._kovalar[anahtar] = (jeton - 1, simdi)
+        return 0.0, None
+
+
+def _kova_ekle(db, anahtar: str, kapasite: float, simdi: float) -> None:
+    db.add(models.IstekKovasi(anahtar=anahtar, jeton=kapasite, guncelleme=simdi))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()  # başka bir worker az önce ekledi
+
+
+def _kovalari_harca(db, kovalar: list[tuple]) -> tuple[float, str | None]:
+    """Her kova tek bir koşullu UPDATE ile harcanır: dolum + kontrol + düşüm SQL'de yapılır.
+
+    Satır kilidi aynı kovaya gelen worker'ları sıraya sokar (oku-yaz yarışı yok); kovalar
+    hep aynı sırayla güncellendiği için kilitlenme olmaz. Biri boşsa işlem geri alınır.
+    """
+    K = models.IstekKovasi
+    # Worker'lar arası ortak saat: duvar saati (monotonic süreç başına ayrı)
+    simdi = time.time()
+    eklenen = set()
+    while True:
+        for kapsam, anahtar, kapasite, dakikada in kovalar:
+            gecen = case((K.guncelleme < simdi, simdi - K.guncelleme), else_=0.0)
+            dolu = case((K.jeton + gecen * (dakikada / 60) > kapasite, kapasite), else_=K.jeton + gecen * (dakikada / 60))
+            guncellenen = db.execute(
+                update(K).where(K.anahtar == anahtar, dolu >= 1).values(jeton=dolu - 1, guncelleme=simdi)
+            ).rowcount
+            if guncellenen == 1:
+                continue
+
+            db.rollback()
+            satir = db.query(K).filter(K.anahtar == anahtar).first()
+            if satir is None and anahtar not in eklenen:
+                # İlk istek: kovayı dolu ekle, baştan dene
+                _kova_ekle(db, anahtar, kapasite, simdi)
+                eklenen.add(anahtar)
+                break
+            if satir is None:
+                return 0.0, None
+            return kova_hesapla(satir.jeton, satir.guncelleme, kapasite, dakikada, simdi)[1], kapsam
+        else:
+            db.commit()
+            return 0.0, None
+
+
+def eski_kovalari_temizle(db) -> int:
+    sinir = time.time() - ISTEK_SINIRI_KOVA_OMRU_SN
+    silinen = db.query(models.IstekKovasi).filter(models.IstekKovasi.guncelleme < sinir).delete(synchronize_session=False)
+    db.commit()
+    return silinen
+
+
+class DbDepo:
+    ad = "db"
+
+    async def harca(self, kovalar: list[tuple]) -> tuple[float, str | None]:
+        try:
+            return await db_calistir(_kovalari_harca, kovalar)
+        except Exception as e:
+            print(f"⚠️ İstek sınırı deposu hatası: {e}")
+            metrics.artir("istek_siniri_depo_hatasi")
+            return 0.0, None
+
+
+def depo_olustur(db_kullanilabilir: bool):
+    if ISTEK_SINIRI_DEPO == "db":
+        if db_kullanilabilir:
+            return DbDepo()
+        print("⚠️ İstek sınırı: veritabanı yok, bellek deposu kullanılıyor")
+    elif ISTEK_SINIRI_DEPO != "bellek":
+        raise ValueError(f"Geçersiz ISTEK_SINIRI_DEPO: {ISTEK_SINIRI_DEPO}")
+    return BellekDepo()
+
+
+def _anahtar(kural: Kural, kapsam: str, deger: str) -> str:
+    if len(deger) > 100:
+        deger = hashlib.sha256(deger.encode("utf-8")).hexdigest()
+    return f"{kural.ad}:{kapsam}:{deger}"
+
+
+def istemci_ip(scope) -> str:
+    if ISTEK_SINIRI_XFF:
+        for ad, deger in scope["headers"]:
+            if ad == b"x-forwarded-for":
+                return deger.decode("latin-1").split(",")[-1].strip()
+    istemci = scope.get("client")
+    return istemci[0] if istemci else "-"
+
+
+async def _govde_oku(receive) -> tuple[bytes, list]:
+    mesajlar, parcalar = [], []
+    while True:
+        mesaj = await receive()
+        mesajlar.append(mesaj)
+        if mesaj["type"] != "http.request":
+            break
+        parcalar.append(mesaj.get("body", b""))
+        if not mesaj.get("more_body"):
+            break
+    return b"".join(parcalar), mesajlar
+
+
+def _yeniden_oynat(mesajlar: list, receive):
+    """Okunan gövde mesajlarını uygulamaya tekrar verir, sonra asıl receive'e döner."""
+    async def _receive():
+        if mesajlar:
+            return mesajlar.pop(0)
+        return await receive()
+    return _receive
+
+
+async def _kullanici_bul(kural: Kural, scope, receive):
+    """(user_id | None, receive): sorgu, yol ya da JSON gövdesinden (gövde okunduysa yeniden oynatılır)."""
+    user_id = urllib.parse.parse_qs(scope["query_string"].decode("latin-1")).get("user_id", [None])[0]
+    if user_id:
+        return user_id, receive
+    if kural.yolda_kullanici:
+        onek = next((onek for onek in kural.yollar if scope["path"].startswith(onek + "/")), None)
+        return (scope["path"][len(onek) + 1:] or None) if onek else None, receive
+    if scope["method"] not in ("POST", "PUT", "PATCH"):
+        return None, receive
+
+    basliklar = dict(scope["headers"])
+    try:
+        uzunluk = int(basliklar.get(b"content-length", b""))
+    except ValueError:
+        return None, receive
+    if b"json" not in basliklar.get(b"content-type", b"") or uzunluk > ISTEK_SINIRI_GOVDE_EN_COK:
+        return None, receive
+
+    govde, mesajlar = await _govde_oku(receive)
+    receive = _yeniden_oynat(mesajlar, receive)
+    try:
+        veri = json.loads(govde)
+    except ValueError:
+        return None, receive
+    user_id = veri.get("user_id") if isinstance(veri, dict) else None
+    return (str(user_id) if user_id else None), receive
+
+
+class IstekSiniriMiddleware:
+    def __init__(self, app, depo=None):
+        self.app = app
+        self.depo = depo or BellekDepo()
+
+    async def __call__(self, scope, receive, send):
+        kural = kural_bul(scope["path"]) if scope["type"] == "http" and scope["method"] != "OPTIONS" else None
+        if not ISTEK_SINIRI_AKTIF or kural is None or not kural.kovalar:
+            return await self.app(scope, receive, send)
+
+        kovalar = []
+        if "ip" in kural.kovalar:
+            kovalar.append(("ip", _anahtar(kural, "ip", istemci_ip(scope)), *kural.kovalar["ip"]))
+        if "kullanici" in kural.kovalar:
+            user_id, receive = await _kullanici_bul(kural, scope, receive)
+            if user_id:
+                kovalar.append(("kullanici", _anahtar(kural, "kullanici", user_id), *kural.kovalar["kullanici"]))
+        if "yol" in kural.kovalar:
+            kovalar.append(("yol", _anahtar(kural, "yol", scope["path"]), *kural.kovalar["yol"]))
+        if "genel" in kural.kovalar:
+            kovalar.append(("genel", _anahtar(kural, "genel", "*"), *kural.kovalar["genel"]))
+
+        with metrics.sure_olc(f"istek_siniri_ms.{self.depo.ad}"):
+            bekleme, kapsam = await self.depo.harca(kovalar)
+        if bekleme:
+            metrics.artir(f"istek_siniri_red.{kural.ad}.{kapsam}")
+            metrics.pencere_artir(f"istek_siniri.{kural.ad}.red")
+            yanit = JSONResponse(
+                {"detail": "Çok fazla istek, lütfen biraz sonra tekrar deneyin"},
+                status_code=429,
+                headers={"Retry-After": str(max(1, math.ceil(bekleme)))},
+            )
+            return await yanit(scope, receive, send)
+
+        metrics.pencere_artir(f"istek_siniri.{kural.ad}.izin")
+        await self.app(scope, receive, send)
@@ -0,0 +1,133 @@
+import asyncio
+from datetime import date
+
+from fastapi import HTTPException
+from sqlalchemy import and_, case, func, or_, select, update
+
+import models
+import metrics
+from database import db_calistir, ekle_veya_guncelle
+
+# --- ANALİZ KOTASI (ayır -> analiz -> gerekirse iade) ---
+# Free kullanıcı ömür boyu LIFETIME_LIMIT analiz yapabilir. Hak, model çağrılarından
+# önce tek bir koşullu UPDATE ile ayrılır: limit kontrolü, sayaç artışı ve gün
+# değişiminde günlük sayacın sıfırlanması aynı ifadededir. Eşzamanlı istekler
+# satır kilidinde sıraya girer, limit aşılamaz (oku-karşılaştır-yaz yarışı yok).
+# Hak analizi gerçekten yapan (tek uçuşun lideri) için ayrılır; aynı rüyanın
+# çift gönderimi liderin sonucuna katılır ve hak harcamaz. Analiz başarısız
+# olursa ayrılan hak iade edilir.
+#
+# Yeni sayaç RETURNING ile alınır (Postgres, SQLite 3.35+, MariaDB); RETURNING
+# olmayan MySQL'de UPDATE'in aldığı satır kilidi commit'e kadar sürdüğü için aynı
+# işlemdeki SELECT aynı değeri okur.
+
+LIFETIME_LIMIT = 5
+
+
+def profil_olustur(db, user_id: str) -> None:
+    """Profili olmayan kullanıcı için varsayılan profil (Fallback); aynı anda gelen ilk istekler çakışmaz."""
+    ekle_veya_guncelle(db, models.UserProfile, {
+        "user_id": user_id,
+        "is_premium": False,
+        "interpreter_type": "psychological", # Varsayılan
+        "last_usage_date": date.today(),
+    }, ["user_id"])
+    db.commit()
+
+
+def profil_sozlugu(user_id: str, is_premium, interpreter_type, zodiac) -> dict:
+    return {
+        "user_id": user_id,
+        "is_premium": bool(is_premium),
+        "interpreter_type": interpreter_type if interpreter_type else "psychological",
+        "zodiac": zodiac if zodiac else "Unknown",
+    }
+
+
+def profil_getir(db, user_id: str) -> dict:
+    """Hak ayırmadan profil (önbellek / tek uçuş anahtarı için); profil yoksa varsayılanı oluşturur."""
+    P = models.UserProfile
+    for _ in range(2):
+        satir = db.execute(select(P.is_premium, P.interpreter_type, P.zodiac).where(P.user_id == user_id)).first()
+        if satir is not None:
+            return profil_sozlugu(user_id, *satir)
+        profil_olustur(db, user_id)
+    raise RuntimeError(f"Profil okunamadı: {user_id}")
+
+
+def ayir(db, user_id: str) -> dict:
+    """Bir analiz hakkı ayırır; profili, yeni sayacı ve ayırma gününü döner (db_executor'da çalışır).
+
+    Free kullanıcının hakkı bittiyse 403 LIMIT_REACHED.
+    """
+    P = models.UserProfile
+    bugun = date.today()
+    sayac = func.coalesce(P.lifetime_usage_count, 0)
+    ifade = (
+        update(P)
+        .where(P.user_id == user_id, or_(P.is_premium.is_(True), sayac < LIFETIME_LIMIT))
+        .values(
+            lifetime_usage_count=sayac + 1,
+            daily_usage_count=case(
+                (P.last_usage_date == bugun, func.coalesce(P.daily_usage_count, 0) + 1), else_=1
+            ),
+            last_usage_date=bugun,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    donenler = (P.lifetime_usage_count, P.is_premium, P.interpreter_type, P.zodiac)
+
+    for _ in range(2):
+        if db.get_bind().dialect.update_returning:
+            satir = db.execute(ifade.returning(*donenler)).first()
+        elif db.execute(ifade).rowcount == 1:
+            satir = db.execute(select(*donenler).where(P.user_id == user_id)).first()
+        else:
+            satir = None
+
+        if satir is not None:
+            db.commit()
+            return {**profil_sozlugu(user_id, *satir[1:]), "kullanim_sayisi": satir[0], "kota_gunu": bugun}
+
+        db.rollback()
+        if db.execute(select(P.id).where(P.user_id == user_id)).first() is not None:
+            metrics.artir("kota_red")
+            raise HTTPException(status_code=403, detail="LIMIT_REACHED")
+        profil_olustur(db, user_id)
+    raise RuntimeError(f"Kota ayrılamadı: {user_id}")
+
+
+def iade(db, user_id: str, kota_gunu: date) -> None:
+    """ayir()'ın telafisi: ömür boyu sayaçtan ve (gün değişmediyse) günlük sayaçtan bir düşer."""
+    P = models.UserProfile
+    db.execute(
+        update(P)
+        .where(P.user_id == user_id, P.lifetime_usage_count > 0)
+        .values(
+            lifetime_usage_count=P.lifetime_usage_count - 1,
+            daily_usage_count=case(
+                (and_(P.last_usage_date == kota_gunu, P.daily_usage_count > 0), P.daily_usage_count - 1),
+                else_=P.daily_usage_count,
+            ),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+async def iade_et(profil: dict) -> None:
+    # İstek iptal edilse de (istemci bağlantıyı kapattı) iade tamamlansın
+    try:
+        await asyncio.shield(db_calistir(iade, profil["user_id"], profil["kota_gunu"]))
+        metrics.artir("kota_iade")
+    except Exception as e:
+        print(f"⚠️ Kota iadesi yapılamadı ({profil['user_id']}): {e}")
+        metrics.artir("kota_iade_hatasi")
+
+
+def on_kontrol(db, user_id: str) -> None:
+    """Hak ayırmadan limit kontrolü (iş kuyruğuna girmeden 403 için); asıl ayırma ayir()'da."""
+    P = models.UserProfile
+    satir = db.execute(select(P.is_premium, P.lifetime_usage_count).where(P.user_id == user_id)).first()
+    if satir and not satir.is_premium and (satir.lifetime_usage_count or 0) >= LIFETIME_LIMIT:
+        raise HTTPException(status_code=403, detail="LIMIT_REACHED")
@@ -0,0 +1,141 @@
+import os
+import asyncio
+from collections import deque
+from datetime import datetime, date, timedelta
+
+from sqlalchemy import and_, case, func, insert
+
+import models
+import metrics
+from database import db_calistir
+
+# --- MODEL KULLANIM KAYDI (token + gecikme) ---
+# Her Gemini çağrısı 'model_kullanimi' tablosuna bir satır olarak eklenir
+# (rota ayarı için hangi modele gittiği de yazılır).
+# İstek yolunda DB'ye gidilmez: satırlar bellekte tamponlanır ve arka plan
+# görevi KULLANIM_YAZMA_ARALIGI_SN'de bir toplu INSERT ile yazar.
+
+KULLANIM_YAZMA_ARALIGI_SN = float(os.getenv("KULLANIM_YAZMA_ARALIGI_SN", "2"))
+KULLANIM_TAMPON_LIMITI = int(os.getenv("KULLANIM_TAMPON_LIMITI", "10000"))
+
+_tampon: deque[dict] = deque()
+
+
+def _token(response, alan: str) -> int:
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, alan, 0) or 0
+
+
+def kaydet(baglam: dict, asama: str, model: str, gecikme_ms: float, sonuc: str, response=None) -> None:
+    """sonuc: 'basarili', 'hata' veya 'iptal' (hedge kaybedeni / zaman aşımı)."""
+    if len(_tampon) >= KULLANIM_TAMPON_LIMITI:
+        _tampon.popleft()
+        metrics.artir("kullanim_dusurulen")
+    simdi = datetime.utcnow()
+    _tampon.append({
+        "zaman": simdi,
+        "gun": simdi.date(),
+        "user_id": baglam.get("user_id"),
+        "asama": asama,
+        "yorumcu": baglam.get("yorumcu"),
+        "uyelik": baglam.get("uyelik"),
+        "model": model,
+        "girdi_token": _token(response, "prompt_token_count"),
+        "tahmini_girdi_token": baglam.get("tahmini_token"),
+        "cikti_token": _token(response, "candidates_token_count"),
+        "gecikme_ms": round(gecikme_ms, 1),
+        "sonuc": sonuc,
+    })
+
+
+def _toplu_yaz(db, satirlar: list[dict]) -> None:
+    db.execute(insert(models.ModelKullanimi), satirlar)
+    db.commit()
+
+
+async def bosalt() -> None:
+    if not _tampon:
+        return
+    satirlar = list(_tampon)
+    _tampon.clear()
+    try:
+        await db_calistir(_toplu_yaz, satirlar)
+        metrics.artir("kullanim_yazilan", len(satirlar))
+    except Exception as e:
+        print(f"⚠️ Kullanım kaydı yazılamadı ({len(satirlar)} satır): {e}")
+        metrics.artir("kullanim_dusurulen", len(satirlar))
+
+
+async def yazici() -> None:
+    while True:
+        await asyncio.sleep(KULLANIM_YAZMA_ARALIGI_SN)
+        await bosalt()
+
+
+# ==========================================
+#              TOPLAMA (RAPOR)
+# ==========================================
+
+GRUPLAMALAR = {
+    "gunluk": ("gun", "asama"),
+    "persona": ("yorumcu", "uyelik", "asama"),
+    "rota": ("uyelik", "asama", "model"),
+}
+
+
+def ozet(db, gruplama: str, gun_sayisi: int) -> list[dict]:
+    """Gruplara göre çağrı/başarısız (hata + iptal) adedi, token toplamları ve p50/p95 gecikme.
+
+    Toplamlar SQL'de GROUP BY ile; yüzdelikler (her veritabanında olmadığı için)
+    gruba ve gecikmeye göre sıralı akıştan hesaplanır, satırlar belleğe alınmaz.
+    İki sorgu arasında yazıcı yeni satır ekleyebilir: ikisi de aynı id üst sınırına
+    bakar (tablo sadece eklemeli), yine de toplamda olmayan grup atlanır.
+    """
+    K = models.ModelKullanimi
+    alanlar = GRUPLAMALAR[gruplama]
+    kolonlar = [getattr(K, ad) for ad in alanlar]
+    ust_id = db.query(func.max(K.id)).scalar() or 0
+    filtre = and_(K.gun >= date.today() - timedelta(days=gun_sayisi - 1), K.id <= ust_id)
+
+    gruplar = {}
+    for satir in db.query(
+        *kolonlar,
+        func.count(K.id),
+        func.sum(case((K.sonuc == "basarili", 1), else_=0)),
+        func.coalesce(func.sum(K.girdi_token), 0),
+        func.coalesce(func.sum(K.cikti_token), 0),
+        func.coalesce(func.sum(K.tahmini_girdi_token), 0),
+    ).filter(filtre).group_by(*kolonlar):
+        anahtar = tuple(satir[:len(kolonlar)])
+        adet, basarili, girdi, cikti, tahmini = satir[len(kolonlar):]
+        gruplar[anahtar] = {
+            **{ad: (deger.isoformat() if isinstance(deger, date) else deger) for ad, deger in zip(alanlar, anahtar)},
+            "cagri": adet,
+            "basarisiz": adet - (basarili or 0),
+            "girdi_token": int(girdi),
+            "cikti_token": int(cikti),
+            "tahmini_girdi_token": int(tahmini),
+            "p50_ms": None,
+            "p95_ms": None,
+            "_basarili": basarili or 0,
+        }
+
+    sira = 0
+    onceki = None
+    gecikmeler = db.query(*kolonlar, K.gecikme_ms).filter(filtre, K.sonuc == "basarili") \
+        .order_by(*kolonlar, K.gecikme_ms).yield_per(1000)
+    for satir in gecikmeler:
+        anahtar = tuple(satir[:len(kolonlar)])
+        sira = sira + 1 if anahtar == onceki else 0
+        onceki = anahtar
+        grup = gruplar.get(anahtar)
+        if grup is None:
+            continue
+        if sira == int(0.50 * grup["_basarili"]):
+            grup["p50_ms"] = satir[-1]
+        if sira == min(grup["_basarili"] - 1, int(0.95 * grup["_basarili"])):
+            grup["p95_ms"] = satir[-1]
+
+    for grup in gruplar.values():
+        del grup["_basarili"]
+    return list(gruplar.values())
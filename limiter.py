@@ -0,0 +1,215 @@
+import os
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+import metrics
+
+# --- ADAPTİF EŞZAMANLILIK SINIRI + DEVRE KESİCİ (Gemini çağrıları) ---
+# Sınır, gözlenen gecikmeye göre AIMD ile ayarlanır: gecikme kendi tabanının
+# LIMIT_TOLERANS katını aşarsa ya da çağrı hata verirse sınır çarpımsal azalır,
+# aksi halde her başarılı çağrıda yavaşça (≈ +1 / tur) artar.
+# Free istekler sınırın (1 - PREMIUM_PAYI) kadarını kullanabilir, doluysa hemen
+# 429 ile reddedilir; premium istekler tüm sınırı kullanır ve kısa süre sıra bekler.
+# Art arda DEVRE_HATA_ESIGI hata sonrası devre açılır ve çağrılar hemen 503 alır.
+# Maliyet ağırlığı: bir çağrı tahmini girdi tokenının her LIMIT_TOKEN_BIRIMI'si
+# için bir yer kaplar (en az 1); uzun rüyalar kısa olanlardan daha fazla yer tutar.
+
+LIMIT_BASLANGIC = float(os.getenv("LIMIT_BASLANGIC", "20"))
+LIMIT_EN_AZ = float(os.getenv("LIMIT_EN_AZ", "2"))
+LIMIT_EN_COK = float(os.getenv("LIMIT_EN_COK", "200"))
+LIMIT_TOLERANS = float(os.getenv("LIMIT_TOLERANS", "2.0"))
+LIMIT_AZALIS_ORANI = float(os.getenv("LIMIT_AZALIS_ORANI", "0.9"))
+LIMIT_AZALIS_ARALIGI_SN = float(os.getenv("LIMIT_AZALIS_ARALIGI_SN", "1.0"))
+PREMIUM_PAYI = float(os.getenv("PREMIUM_PAYI", "0.2"))
+PREMIUM_BEKLEME_SN = float(os.getenv("PREMIUM_BEKLEME_SN", "5"))
+LIMIT_TOKEN_BIRIMI = int(os.getenv("LIMIT_TOKEN_BIRIMI", "1000"))
+
+DEVRE_HATA_ESIGI = int(os.getenv("DEVRE_HATA_ESIGI", "5"))
+DEVRE_ACIK_SN = float(os.getenv("DEVRE_ACIK_SN", "30"))
+
+TABAN_ALFA = 0.05
+
+
+class KapasiteAsimi(Exception):
+    """Çağrı yapılmadan reddedildi (429: sınır dolu, 503: devre açık)."""
+
+    def __init__(self, status_code: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class AdaptifSinirlayici:
+    def __init__(self):
+        self.limit = LIMIT_BASLANGIC
+        self.aktif = 0
+        self._bekleyenler: deque[tuple[asyncio.Future, int]] = deque()
+        self._taban: dict[str, float] = {}  # çağrı türü -> gecikme EWMA (ms)
+        self._son_azalis = 0.0
+
+    def free_siniri(self) -> int:
+        return max(1, int(self.limit * (1 - PREMIUM_PAYI)))
+
+    def retry_after(self) -> int:
+        """Bir yerin boşalması için tahmini bekleme (saniye)."""
+        ortalama_ms = sum(self._taban.values()) / len(self._taban) if self._taban else 1000
+        fazla = max(1, self.aktif - self.free_siniri() + 1 + len(self._bekleyenler))
+        return max(1, math.ceil(ortalama_ms / 1000 * fazla / max(1.0, self.limit)))
+
+    async def al(self, premium: bool, agirlik: int = 1) -> int:
+        """Yer alır ve gerçekten ayrılan ağırlığı döner (birak()'a aynen verilmeli)."""
+        if not premium:
+            agirlik = min(agirlik, self.free_siniri())
+            if self.aktif + agirlik > self.free_siniri() or self._bekleyenler:
+                metrics.artir("limiter_reddedilen.free")
+                raise KapasiteAsimi(429, self.retry_after(), "Sunucu yoğun, lütfen tekrar deneyin")
+            self.aktif += agirlik
+            self._metrik()
+            return agirlik
+
+        agirlik = min(agirlik, max(1, int(self.limit)))
+        if self.aktif + agirlik <= int(self.limit) and not self._bekleyenler:
+            self.aktif += agirlik
+            self._metrik()
+            return agirlik
+
+        # Premium: kısa süre sıra bekle (yer, birak() içinde bize ayrılır)
+        bekleyen = asyncio.get_running_loop().create_future()
+        kayit = (bekleyen, agirlik)
+        self._bekleyenler.append(kayit)
+        self._metrik()
+        try:
+            await asyncio.wait_for(bekleyen, PREMIUM_BEKLEME_SN)
+            return agirlik
+        except asyncio.TimeoutError:
+            metrics.artir("limiter_reddedilen.premium")
+            raise KapasiteAsimi(429, self.retry_after(), "Sunucu yoğun, lütfen tekrar deneyin")
+        except asyncio.CancelledError:
+            if bekleyen.done() and not bekleyen.cancelled():
+                self.birak("", 0, None, agirlik)
+            raise
+        finally:
+            if kayit in self._bekleyenler:
+                self._bekleyenler.remove(kayit)
+
+    def birak(self, tur: str, gecikme_ms: float, basarili: bool | None, agirlik: int = 1) -> None:
+        """basarili: True/False, None: iptal (sadece gecikmeye bakılır)."""
+        self.aktif -= agirlik
+        if tur:
+            self._ayarla(tur, gecikme_ms, basarili)
+        # Sıradakine yer açılana kadar bekle (FIFO; ağır bir bekleyeni hafifler geçmez)
+        while self._bekleyenler:
+            bekleyen, bekleyen_agirlik = self._bekleyenler[0]
+            if bekleyen.done():
+                self._bekleyenler.popleft()
+                continue
+            if self.aktif + bekleyen_agirlik > int(self.limit):
+                break
+            self._bekleyenler.popleft()
+            self.aktif += bekleyen_agirlik
+            bekleyen.set_result(None)
+        self._metrik()
+
+    def _ayarla(self, tur: str, gecikme_ms: float, basarili: bool | None) -> None:
+        taban = self._taban.get(tur)
+        yavas = taban is not None and gecikme_ms > taban * LIMIT_TOLERANS
+        if basarili is False or yavas:
+            simdi = time.monotonic()
+            # Aynı yavaşlama dalgası için sınırı art arda düşürmeyelim
+            if simdi - self._son_azalis >= LIMIT_AZALIS_ARALIGI_SN:
+                self.limit = max(LIMIT_EN_AZ, self.limit * LIMIT_AZALIS_ORANI)
+                self._son_azalis = simdi
+                metrics.artir("limiter_azalis")
+        elif basarili:
+            self.limit = min(LIMIT_EN_COK, self.limit + 1 / self.limit)
+
+        if basarili:
+            self._taban[tur] = gecikme_ms if taban is None else taban * (1 - TABAN_ALFA) + gecikme_ms * TABAN_ALFA
+
+    def _metrik(self) -> None:
+        metrics.ayarla("limiter_limit", round(self.limit, 2))
+        metrics.ayarla("limiter_free_siniri", self.free_siniri())
+        metrics.ayarla("limiter_aktif", self.aktif)
+        metrics.ayarla("limiter_bekleyen_premium", len(self._bekleyenler))
+
+
+class DevreKesici:
+    KAPALI, YARI_ACIK, ACIK = "kapali", "yari_acik", "acik"
+
+    def __init__(self):
+        self.durum = self.KAPALI
+        self.ardisik_hata = 0
+        self._acilma = 0.0
+        self._deneme_yolda = False
+
+    def izin_ver(self) -> None:
+        if self.durum == self.ACIK:
+            kalan = self._acilma + DEVRE_ACIK_SN - time.monotonic()
+            if kalan > 0:
+                metrics.artir("devre_reddedilen")
+                raise KapasiteAsimi(503, math.ceil(kalan), "Yorum servisi geçici olarak kullanılamıyor")
+            self._durum_ayarla(self.YARI_ACIK)
+
+        if self.durum == self.YARI_ACIK:
+            # Yarı açıkken tek bir deneme çağrısına izin ver
+            if self._deneme_yolda:
+                metrics.artir("devre_reddedilen")
+                raise KapasiteAsimi(503, 1, "Yorum servisi geçici olarak kullanılamıyor")
+            self._deneme_yolda = True
+
+    def sonuc(self, basarili: bool | None) -> None:
+        self._deneme_yolda = False
+        if basarili:
+            self.ardisik_hata = 0
+            self._durum_ayarla(self.KAPALI)
+        elif basarili is False:
+            self.ardisik_hata += 1
+            if self.durum == self.YARI_ACIK or self.ardisik_hata >= DEVRE_HATA_ESIGI:
+                if self.durum != self.ACIK:
+                    metrics.artir("devre_acildi")
+                self._acilma = time.monotonic()
+                self._durum_ayarla(self.ACIK)
+
+    def _durum_ayarla(self, durum: str) -> None:
+        self.durum = durum
+        metrics.ayarla("devre_durumu", {self.KAPALI: 0, self.YARI_ACIK: 1, self.ACIK: 2}[durum])
+
+
+sinirlayici = AdaptifSinirlayici()
+devre = DevreKesici()
+
+
+def agirlik_hesapla(tahmini_token: int | None) -> int:
+    if not tahmini_token:
+        return 1
+    return max(1, math.ceil(tahmini_token / LIMIT_TOKEN_BIRIMI))
+
+
+@asynccontextmanager
+async def model_cagrisi(uyelik: str, asama: str, tahmini_token: int | None = None):
+    """Her Gemini çağrısı bu bağlam içinde yapılır: devre kontrolü, yer alma, AIMD geri bildirimi."""
+    devre.izin_ver()
+    try:
+        agirlik = await sinirlayici.al(uyelik == "premium", agirlik_hesapla(tahmini_token))
+    except BaseException:
+        devre.sonuc(None)
+        raise
+
+    baslangic = time.perf_counter()
+    basarili = None
+    try:
+        yield
+        basarili = True
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        basarili = False
+        raise
+    finally:
+        gecikme_ms = (time.perf_counter() - baslangic) * 1000
+        sinirlayici.birak(f"{asama}.{uyelik}", gecikme_ms, basarili, agirlik)
+        devre.sonuc(basarili)
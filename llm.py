@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import datetime
+import google.generativeai as genai
+from google.api_core import exceptions as google_hatalari
+
+import promptlar
+
+# --- MODEL KAYDI ---
+# (yorumcu, üyelik, aşama) başına bir model: persona system_instruction olarak,
+# rotanın model adı ve generation_config'i ile başlangıçta bir kez kurulur.
+# Modeli kuran sağlayıcı LLM_SAGLAYICI ile seçilir:
+#   "gemini": google.generativeai (varsayılan)
+#   "sahte":  ağ/API anahtarı gerektirmeyen süreç içi taklit (bkz. sahte_llm.py)
+# Sağlayıcıların döndürdüğü modeller GenerativeModel'in bizim kullandığımız
+# yüzeyini sunar: model_name, start_chat(history) -> sohbet (history,
+# send_message_async(icerik, generation_config=, stream=)), generate_content_async;
+# cevaplarda .text, .usage_metadata ve stream=True ise async parça akışı.
+
+MODEL_ADI = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+# Premium yorumlar için en güçlü, free tanıtımlar ve kısa aşamalar için en hafif model
+GUCLU_MODEL = os.getenv("GEMINI_GUCLU_MODEL", MODEL_ADI)
+HAFIF_MODEL = os.getenv("GEMINI_HAFIF_MODEL", "gemini-2.0-flash-lite")
+LLM_SAGLAYICI = os.getenv("LLM_SAGLAYICI", "gemini")
+
+# Üyeliğe göre üretim ayarları (free: 50 kelimelik tanıtım için sert token sınırı)
+URETIM_AYARLARI = {
+    "premium": {
+        "temperature": float(os.getenv("PREMIUM_TEMPERATURE", "0.9")),
+        "max_output_tokens": int(os.getenv("PREMIUM_MAX_TOKEN", "2048")),
+    },
+    "free": {
+        "temperature": float(os.getenv("FREE_TEMPERATURE", "0.8")),
+        "max_output_tokens": int(os.getenv("FREE_MAX_TOKEN", "160")),
+    },
+}
+# Başlık/duygu ve görsel prompt aşamaları, üyelik sınırından bağımsız
+ZENGINLESTIRME_AYARI = {"max_output_tokens": int(os.getenv("ZENGINLESTIRME_MAX_TOKEN", "400"))}
+# "Başlık | Duygu" cevabı birkaç kelime; sıkı sınır
+BASLIK_DUYGU_AYARI = {"max_output_tokens": int(os.getenv("BASLIK_DUYGU_MAX_TOKEN", "60"))}
+
+# --- MODEL YÖNLENDİRME ---
+# (üyelik, aşama) -> {"model": ..., generation_config alanları}. Varsayılanlar
+# aşağıda; MODEL_ROTALARI (JSON) ile rota bazında ezilebilir, örn.:
+#   MODEL_ROTALARI='{"free": {"yorum": {"model": "gemini-2.0-flash", "max_output_tokens": 120}}}'
+# "yorum" rotası akışlı yorumda da kullanılır.
+ASAMALAR = ("yorum", "baslik_duygu", "gorsel", "tek")
+
+
+def _varsayilan_rotalar() -> dict:
+    rotalar = {}
+    for uyelik_adi, ayar in URETIM_AYARLARI.items():
+        yorum_modeli = GUCLU_MODEL if uyelik_adi == "premium" else HAFIF_MODEL
+        rotalar[uyelik_adi] = {
+            "yorum": {"model": yorum_modeli, **ayar},
+            "baslik_duygu": {"model": HAFIF_MODEL, **BASLIK_DUYGU_AYARI},
+            "gorsel": {"model": HAFIF_MODEL, **ZENGINLESTIRME_AYARI},
+            # Tek çağrıda yorumun token sınırına başlık/duygu/görsel alanları için pay ekliyoruz
+            "tek": {
+                "model": yorum_modeli,
+                **ayar,
+                "max_output_tokens": ayar["max_output_tokens"] + ZENGINLESTIRME_AYARI["max_output_tokens"],
+            },
+        }
+    return rotalar
+
+
+def _rotalari_yukle() -> dict:
+    rotalar = _varsayilan_rotalar()
+    for uyelik_adi, asamalar in json.loads(os.getenv("MODEL_ROTALARI", "{}")).items():
+        for asama, ayar in asamalar.items():
+            if uyelik_adi not in rotalar or asama not in ASAMALAR:
+                raise ValueError(f"Geçersiz model rotası: {uyelik_adi}/{asama}")
+            rotalar[uyelik_adi][asama] = {**rotalar[uyelik_adi][asama], **ayar}
+    return rotalar
+
+
+ROTALAR = _rotalari_yukle()
+
+
+def rota(uyelik_adi: str, asama: str) -> dict:
+    return ROTALAR[uyelik_adi][asama]
+
+
+# Gemini context caching: sabit sistem talimatı önbelleğe alınır (API/model desteklemiyorsa atlanır).
+# Önbellek TTL sonunda sunucuda silinir; model_getir süresi dolmak üzere olan
+# modeli (YENILEME_PAYI kala) yeni bir önbellekle yeniden kurar. Önbellek erken
+# kaybolursa (NotFound) model geçersiz sayılır ve sonraki istekte yeniden kurulur;
+# kurulamazsa önbelleksiz modele düşülür.
+BAGLAM_ONBELLEGI = os.getenv("BAGLAM_ONBELLEGI", "0") == "1"
+BAGLAM_ONBELLEGI_TTL_SN = int(os.getenv("BAGLAM_ONBELLEGI_TTL_SN", "3600"))
+BAGLAM_ONBELLEGI_YENILEME_PAYI_SN = int(os.getenv(
+    "BAGLAM_ONBELLEGI_YENILEME_PAYI_SN", str(min(300, BAGLAM_ONBELLEGI_TTL_SN // 10))))
+
+
+class GeminiSaglayici:
+    def model_kur(self, model_adi: str, ad: str, sistem_talimati: str, ayar: dict) -> genai.GenerativeModel:
+        if BAGLAM_ONBELLEGI:
+            try:
+                onbellek = genai.caching.CachedContent.create(
+                    model=model_adi,
+                    display_name=f"ruya-{ad}",
+                    system_instruction=sistem_talimati,
+                    ttl=datetime.timedelta(seconds=BAGLAM_ONBELLEGI_TTL_SN),
+                )
+                model = genai.GenerativeModel.from_cached_content(onbellek, generation_config=ayar)
+                model._baglam_bitis = time.monotonic() + BAGLAM_ONBELLEGI_TTL_SN - BAGLAM_ONBELLEGI_YENILEME_PAYI_SN
+                return model
+            except Exception as e:
+                # Örn. sistem talimatı minimum önbellek boyutunun altında
+                print(f"⚠️ Bağlam önbelleği kullanılamadı ({ad}): {e}")
+
+        return genai.GenerativeModel(model_adi, system_instruction=sistem_talimati, generation_config=ayar)
+
+
+def _gecerli(model) -> bool:
+    """Bağlam önbelleğine bağlı model önbellek süresi dolmadan önce geçerlidir; diğerleri hep."""
+    bitis = getattr(model, "_baglam_bitis", None)
+    return bitis is None or time.monotonic() < bitis
+
+
+def hata_bildir(model, hata: Exception) -> None:
+    """Çağrı hatası önbelleğin kaybolduğunu gösteriyorsa modeli yeniden kurulmak üzere işaretler."""
+    if getattr(model, "_baglam_bitis", None) is not None and isinstance(hata, google_hatalari.NotFound):
+        print(f"⚠️ Bağlam önbelleği bulunamadı, model yeniden kurulacak: {hata}")
+        model._baglam_bitis = 0.0
+
+
+def _saglayici_sec():
+    if LLM_SAGLAYICI == "gemini":
+        return GeminiSaglayici()
+    if LLM_SAGLAYICI == "sahte":
+        import sahte_llm
+        print("🧪 Sahte LLM sağlayıcısı kullanılıyor (Gemini'ye istek atılmaz)")
+        return sahte_llm.SahteSaglayici()
+    raise ValueError(f"Geçersiz LLM_SAGLAYICI: {LLM_SAGLAYICI}")
+
+
+saglayici = _saglayici_sec()
+_modeller: dict[tuple[str, str, str], object] = {}
+
+
+def uyelik(is_premium: bool) -> str:
+    return "premium" if is_premium else "free"
+
+
+def _model_kur(yorumcu: str, is_premium: bool, asama: str):
+    sistem_talimati = promptlar.sistem_talimati_olustur(yorumcu, is_premium)
+    ayar = dict(rota(uyelik(is_premium), asama))
+    model_adi = ayar.pop("model")
+    return saglayici.model_kur(model_adi, f"{yorumcu}-{uyelik(is_premium)}-{asama}", sistem_talimati, ayar)
+
+
+def modelleri_hazirla() -> None:
+    """Tüm (yorumcu, üyelik, aşama) modellerini kurar; uygulama başlarken çağrılır."""
+    for yorumcu in promptlar.PERSONALAR:
+        for is_premium in (True, False):
+            for asama in ASAMALAR:
+                _modeller[(yorumcu, uyelik(is_premium), asama)] = _model_kur(yorumcu, is_premium, asama)
+    for uyelik_adi, asamalar in ROTALAR.items():
+        print(f"🧭 Model rotaları ({uyelik_adi}): " + ", ".join(f"{a}={r['model']}" for a, r in asamalar.items()))
+
+
+def ozel_model_getir(ad: str, sistem_talimati: str, uyelik_adi: str, asama: str):
+    """Persona yerine verilen sistem talimatıyla rotanın modeli (toplu işler için); model_getir gibi saklanır."""
+    anahtar = (ad, uyelik_adi, asama)
+    if anahtar not in _modeller or not _gecerli(_modeller[anahtar]):
+        ayar = dict(rota(uyelik_adi, asama))
+        model_adi = ayar.pop("model")
+        _modeller[anahtar] = saglayici.model_kur(model_adi, f"{ad}-{uyelik_adi}-{asama}", sistem_talimati, ayar)
+    return _modeller[anahtar]
+
+
+def model_getir(yorumcu: str, is_premium: bool, asama: str = "yorum"):
+    if yorumcu not in promptlar.PERSONALAR:
+        yorumcu = promptlar.VARSAYILAN_YORUMCU
+    anahtar = (yorumcu, uyelik(is_premium), asama)
+    if anahtar not in _modeller or not _gecerli(_modeller[anahtar]):
+        _modeller[anahtar] = _model_kur(yorumcu, is_premium, asama)
+    return _modeller[anahtar]
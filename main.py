@@ -1,18 +1,36 @@
 import os
-import urllib.parse
+import json
+import base64
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, date # <--- DÜZELTME 1: date buraya eklendi
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
-from sqlalchemy import Boolean, Date
+from sqlalchemy import Boolean, Date, select, tuple_
 import uvicorn
+import anyio.to_thread
 import google.generativeai as genai
 from dotenv import load_dotenv
 
 # --- Kendi oluşturduğumuz dosyalar ---
 import models
-from database import engine, SessionLocal
+import analiz
+import llm
+import metrics
+import onbellek
+import tek_ucus
+import isler
+import kullanim
+import resim
+import on_eleme
+import istek_siniri
+import kota
+import migrasyon
+from limiter import KapasiteAsimi
+from database import engine, SessionLocal, db_calistir, ekle_veya_guncelle, havuz_durumu, havuzu_isit, DB_HAVUZ_ISITMA
 
 # --- Ayarlar ---
 load_dotenv()
@@ -21,34 +39,86 @@ api_key = os.getenv("GEMINI_API_KEY")
 if api_key:
     genai.configure(api_key=api_key)
 
-# Model seçimi
-model = genai.GenerativeModel("gemini-2.0-flash")
+THREADPOOL_ORNEKLEME_SN = float(os.getenv("THREADPOOL_ORNEKLEME_SN", "0.5"))
 
 # --- Veritabanı Başlatma ---
 db_available = False
 try:
-    # --- YENİ EKLENECEK SATIR (GEÇİCİ) ---
-    # B gtu satır mevcut tabloları siler, böylece yeni sütunlarla (burç vb.) tekrar oluşur.
-    #models.Base.metadata.drop_all(bind=engine) 
-    # -------------------------------------
+    # Yeni tablolar create_all ile; var olan tablolardaki değişiklikler veri
+    # silinmeden sürümlü migrasyonlarla (migrasyon.py)
     models.Base.metadata.create_all(bind=engine)
+    migrasyon.calistir(engine)
     db_available = True
     print("✅ Veritabanı bağlantısı başarılı!")
 except Exception as e:
     print(f"⚠️ Veritabanı bağlantı hatası: {str(e)}")
     print("API sunucusu veritabanı olmadan başlatılıyor (Hata verebilir)...")
 
+# --- Threadpool Doluluk Takibi ---
+# Sync endpoint'ler anyio threadpool'unda (varsayılan 40 token) çalışır.
+# Periyodik olarak kullanılan token sayısını ve tepe değerini /metrics'e yazıyoruz.
+analiz_devam_eden = 0
+
+async def threadpool_izle():
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    while True:
+        metrics.ayarla("threadpool_kullanilan", limiter.borrowed_tokens)
+        metrics.ayarla("threadpool_toplam", limiter.total_tokens)
+        metrics.en_yuksek("threadpool_kullanilan_tepe", limiter.borrowed_tokens)
+        await asyncio.sleep(THREADPOOL_ORNEKLEME_SN)
+
+async def kiralari_temizle():
+    # Süresi çoktan dolmuş tek uçuş kiralarını, istek sınırı kovalarını ve yorum önbelleği
+    # satırlarını ve saklama süresi geçen biten işleri periyodik olarak sil, görsel disk
+    # önbelleğini sınırda tut; çöken worker'da takılı kalan işleri kuyruğa geri al
+    while True:
+        await asyncio.sleep(600)
+        try:
+            await db_calistir(tek_ucus.eski_kiralari_temizle)
+            await db_calistir(istek_siniri.eski_kovalari_temizle)
+            await db_calistir(onbellek.eski_kayitlari_temizle)
+            await asyncio.to_thread(resim.disk_temizle)
+            await db_calistir(isler.eski_isleri_temizle)
+            await isler.takilanlari_kuyruga_al()
+        except Exception as e:
+            print(f"⚠️ Kira temizleme hatası: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # (yorumcu, üyelik) modellerini bir kez kur (bağlam önbelleği açıksa ağ çağrısı yapar)
+    await asyncio.to_thread(llm.modelleri_hazirla)
+    gorevler = [asyncio.create_task(threadpool_izle())]
+    if db_available:
+        if DB_HAVUZ_ISITMA:
+            acilan = await asyncio.to_thread(havuzu_isit)
+            print(f"🔥 DB havuzu ısıtıldı: {acilan} bağlantı")
+        gorevler.append(asyncio.create_task(kiralari_temizle()))
+        gorevler.append(asyncio.create_task(kullanim.yazici()))
+        await isler.baslat(_isi_calistir)
+    yield
+    for gorev in gorevler:
+        gorev.cancel()
+    if db_available:
+        await isler.durdur()
+        await kullanim.bosalt()
+    await resim.kapat()
+
 # --- Uygulama Başlatma ve CORS ---
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 origins = ["*"] 
 
+# İstek sınırı CORS'un içinde kalsın: 429 cevapları da CORS başlıklarını alsın
+app.add_middleware(istek_siniri.IstekSiniriMiddleware, depo=istek_siniri.depo_olustur(db_available))
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # /gecmis sonraki sayfa imleci (tarayıcı istemcileri okuyabilsin)
+    expose_headers=["X-Sonraki-Imlec", "Link"],
 )
 
 # --- Veritabanı Oturumu (Dependency) ---
@@ -66,7 +136,7 @@ def get_db():
 # ==========================================
 
 class RuyaIstegi(BaseModel):
-    ruya_metni: str
+    ruya_metni: str = Field(max_length=on_eleme.GIRDI_EN_COK_KARAKTER)
     user_id: str
 
 # --- MODEL GÜNCELLEMESİ ---
@@ -90,6 +160,15 @@ def health_check():
         "database": "connected" if db_available else "disconnected"
     }
 
+@app.get("/metrics")
+async def metrik_getir():
+    return metrics.ozet()
+
+# Bağlantı havuzunun anlık durumu (checkout süresi, açılan bağlantı vb. /metrics'te db_havuz_*)
+@app.get("/metrics/db-havuz")
+async def db_havuz_getir():
+    return havuz_durumu()
+
 # --- 1. AVATAR / PROFİL İŞLEMLERİ ---
 # --- 1. PROFİL İŞLEMLERİ (GÜNCELLENDİ) ---
 # --- GÜNCELLENEN: GET PROFILE (Premium bilgisini de gönderiyoruz) ---
@@ -117,227 +196,392 @@ def get_profile(user_id: str, db: Session = Depends(get_db)):
 
 @app.post("/set-profile")
 def set_profile(data: AvatarUpdate, db: Session = Depends(get_db)):
-    profile = db.query(models.UserProfile).filter(models.UserProfile.user_id == data.user_id).first()
-    
-    if not profile:
-        new_profile = models.UserProfile(
-            user_id=data.user_id, 
-            avatar_choice=data.choice,
-            zodiac=data.zodiac,
-            interpreter_type=data.interpreter_type # <--- YENİ
-        )
-        db.add(new_profile)
-    else:
-        if data.choice: profile.avatar_choice = data.choice
-        if data.zodiac: profile.zodiac = data.zodiac
-        if data.interpreter_type: profile.interpreter_type = data.interpreter_type # <--- YENİ
-    
+    # Tek ifadede: profil yoksa oluştur, varsa sadece gönderilen (boş olmayan) alanları güncelle
+    alanlar = {
+        "avatar_choice": data.choice,
+        "zodiac": data.zodiac,
+        "interpreter_type": data.interpreter_type, # <--- YENİ
+    }
+    alanlar = {ad: deger for ad, deger in alanlar.items() if deger}
+    ekle_veya_guncelle(db, models.UserProfile, {"user_id": data.user_id, **alanlar}, ["user_id"], alanlar)
     db.commit()
     return {"status": "success"}
 
 # --- IAP TAMAMLANDI ---
 @app.post("/set-premium")
 def set_premium(data: PremiumUpdate, db: Session = Depends(get_db)):
-    profile = db.query(models.UserProfile).filter(models.UserProfile.user_id == data.user_id).first()
-    
-    if not profile:
-        # Profil yoksa oluştur ve Premium yap
-        new_profile = models.UserProfile(
-            user_id=data.user_id, 
-            is_premium=data.is_premium,
-            daily_usage_count=0,
-            lifetime_usage_count=0,
-            last_usage_date=date.today()
-        )
-        db.add(new_profile)
-    else:
-        # Profil varsa güncelle
-        profile.is_premium = data.is_premium
-    
+    # Profil yoksa oluştur ve Premium yap, varsa sadece premium bilgisini güncelle
+    profil = ekle_veya_guncelle(
+        db, models.UserProfile,
+        {
+            "user_id": data.user_id,
+            "is_premium": data.is_premium,
+            "daily_usage_count": 0,
+            "lifetime_usage_count": 0,
+            "last_usage_date": date.today(),
+        },
+        ["user_id"],
+        {"is_premium": data.is_premium},
+        donen=(models.UserProfile.is_premium,),
+    )
     db.commit()
-    return {"status": "success", "is_premium": data.is_premium}
+    return {"status": "success", "is_premium": bool(profil.is_premium)}
 
 
 # --- 2. RÜYA ANALİZ (GÜNCELLENDİ) ---
 # --- 2. RÜYA ANALİZ (GÜNCELLENMİŞ VERSİYON) ---
 # --- 2. RÜYA ANALİZ (DÜZELTİLMİŞ & GARANTİLİ VERSİYON) ---
 # --- 2. RÜYA ANALİZ (YORUMCU MANTIĞI EKLENDİ) ---
-@app.post("/analiz-et")
-def analiz_et(istek: RuyaIstegi, db: Session = Depends(get_db)):
-    try:
-        # 1. KULLANICIYI BUL
-        user_profile = db.query(models.UserProfile).filter(models.UserProfile.user_id == istek.user_id).first()
-        
-        # Eğer profil yoksa oluştur (Fallback)
-        if not user_profile:
-            user_profile = models.UserProfile(
-                user_id=istek.user_id, 
-                is_premium=False,
-                interpreter_type="psychological", # Varsayılan
-                last_usage_date=date.today()
-            )
-            db.add(user_profile)
-            db.commit()
-
-        # ... (Limit ve Tarih kontrolleri aynı kalıyor) ...
-        bugun = date.today()
-        if user_profile.last_usage_date != bugun:
-            user_profile.daily_usage_count = 0
-            user_profile.last_usage_date = bugun
-            db.commit()
-
-        LIFETIME_LIMIT = 5
-        if not user_profile.is_premium and user_profile.lifetime_usage_count >= LIFETIME_LIMIT:
-            raise HTTPException(status_code=403, detail="LIMIT_REACHED")
-
-        # --- YORUMCU SEÇİMİ VE PERSONA BELİRLEME ---
-        secilen_yorumcu = user_profile.interpreter_type if user_profile.interpreter_type else "psychological"
-        user_zodiac = user_profile.zodiac if user_profile.zodiac else "Unknown"
-
-        system_persona = ""
-        
-        if secilen_yorumcu == "religious":
-            # DİNİ / GELENEKSEL (İbn-i Sirin Tarzı)
-            system_persona = """
-            You are Ibn Sirin (Traditional Interpreter). 
-            Interpret the dream as a divine message, omen, or warning based on traditional symbolism (like Ibn-i Sirin).
-            Focus on destiny, moral warnings, and religious good tidings.
-            Tone: Authoritative, wise, fatalistic, and sacred.
-            """
-        elif secilen_yorumcu == "spiritual":
-            # SPİRİTÜEL / KOZMİK (Enerji, Çakra)
-            system_persona = """
-            You are an 'Star Reader' (Spiritual Mystic).
-            Interpret the dream as a flow of cosmic energy, vibrations, and universal messages.
-            Focus on chakras, spiritual alignment, aura, and the connection with the universe.
-            Tone: Ethereal, soothing, magical, and uplifting.
-            """
-        else:
-            # PSİKOLOJİK (Freud/Jung - Varsayılan)
-            system_persona = """
-            You are an 'Healer of the Soul' (Psychological Analyst).
-            Interpret the dream using archetypes and subconscious analysis (like Jung/Freud).
-            Focus on the user's hidden fears, repressed desires, shadow self, and inner conflicts.
-            Tone: Intense, analytical, mysterious, and probing.
-            """
-
-        # --- PREMIUM / FREE TALİMATLARI (AYNI) ---
-        if user_profile.is_premium:
-            ozel_talimatlar = """
-            - **Depth:** Provide a profound, multi-layered analysis based on your specific persona.
-            - **Structure:**
-                1. **Symbol Decoding:** Decode key symbols strictly through your persona's lens.
-                2. **Personal Connection:** Connect the dream to the user's waking life.
-                3. **Specific Advice:** Conclude with advice that fits your persona.
-            - **Length:** Detailed and comprehensive.
-            """
-        else:
-            ozel_talimatlar = """
-            - **Constraint:** Keep the response STRICTLY under 50 words.
-            - **Content:** Provide a "teaser" interpretation only. Identify the single most important symbol.
-            - **Call to Action (CTA):** End by saying  "To hear the full wisdom, unlock Premium." in the **EXACT SAME LANGUAGE** as the dream.
-            """
-
-        # --- ANA PROMPT BİRLEŞTİRME ---
-        prompt = f"""
-### SYSTEM ROLE (YOUR PERSONA)
-{system_persona}
-
-### USER CONTEXT
-- **Zodiac Sign:** {user_zodiac}
-- **Dream Content:** "{istek.ruya_metni}"
-
-### INSTRUCTIONS
-1. **Language Detection & Output:**
-   - Detect the language of the "Dream Content".
-   - **CRITICAL:** Your entire response must be in the **EXACT SAME LANGUAGE** as the dream.
-   
-2. **Analysis Instructions:**
-{ozel_talimatlar}
-
-### OUTPUT GENERATION
-Speak now, wise one.
-"""       
-        # --- DÜZELTME BİTİŞİ ---
-
-        # A. Gemini Sohbetini Başlat
-        chat = model.start_chat(history=[])
-        response = chat.send_message(prompt)
-        ai_cevabi = response.text
-
-        # B. Başlık ve Duygu (Aynı kalıyor)
-        ek_bilgi_prompt = "Based on the dream above, create a mysterious title (3-5 words) and identify the dominant emotion. Use same  the **EXACT SAME LANGUAGE** as the dream. Output format strictly: Title | Emotion"
-        ek_response = chat.send_message(ek_bilgi_prompt)
-        ek_metin = ek_response.text.strip()
-        
-        ruya_basligi = "Bilinçaltı Mesajı"
-        ruya_duygusu = "Nötr"
-        try:
-            if "|" in ek_metin:
-                parts = ek_metin.split('|')
-                if len(parts) >= 2:
-                    ruya_basligi = parts[0].strip().replace('"', '')
-                    ruya_duygusu = parts[1].strip().replace('.', '')
-            else:
-                ruya_basligi = ek_metin
-        except:
-            pass 
-
-        # C. Görsel Prompt (Aynı kalıyor)
-        gorsel_prompt_istegi = f"""Based on the dream above, create a highly detailed, mystical, and artistic image description suitable for an AI image generator.
-        Describe the scene, lighting, and mood.
-        CRITICAL: The output must be in English regardless of the dream language.
-        """
-        gorsel_response = chat.send_message(gorsel_prompt_istegi)
-        gorsel_prompt = gorsel_response.text.strip()
-        
-        # D. Resim URL (Aynı kalıyor)
-        encoded_prompt = urllib.parse.quote(gorsel_prompt)
-        resim_url = f"https://image.pollinations.ai/prompt/{encoded_prompt}?width=768&height=1024&seed={datetime.now().microsecond}&nologo=true"
-
-# --- EKSİK OLAN TANIMLAMA BURAYA EKLENDİ ---
-        # Tarihi string formatında (Gün.Ay.Yıl) alıyoruz
-        otomatik_tarih = datetime.now().strftime("%d.%m.%Y")
-        # 4. KAYIT VE SAYAÇ
-        yeni_ruya = models.Ruya(
-            user_id=istek.user_id,
-            ruya_metni=istek.ruya_metni, 
-            baslik=ruya_basligi,
-            yorum=ai_cevabi,
-            resim_url=resim_url,
-            duygu=ruya_duygusu,
-            tarih=otomatik_tarih
-        )
-        db.add(yeni_ruya)
-        
-        user_profile.daily_usage_count += 1
-        user_profile.lifetime_usage_count += 1
-        
-        db.commit()
-        db.refresh(yeni_ruya)
+# --- 2. RÜYA ANALİZ (ASYNC: Gemini beklerken threadpool'u meşgul etmez) ---
+
+def _ruya_kaydet(db: Session, user_id: str, ruya_metni: str, sonuc: dict) -> tuple[int, str | None]:
+    """Rüyayı kaydeder (db_executor'da çalışır); kullanım hakkı analizden önce kota.ayir() ile düşülür.
+
+    Görsel seed'i rüya id'sinden türetildiği için resim URL'i id alındıktan
+    (flush) sonra, aynı işlem içinde yazılır.
+    """
+    # Tarihi string formatında (Gün.Ay.Yıl) alıyoruz
+    otomatik_tarih = datetime.now().strftime("%d.%m.%Y")
+    yeni_ruya = models.Ruya(
+        user_id=user_id,
+        ruya_metni=ruya_metni,
+        baslik=sonuc["baslik"],
+        yorum=sonuc["yorum"],
+        duygu=sonuc["duygu"],
+        tarih=otomatik_tarih,
+        created_at=datetime.utcnow(),
+        icerik_ozeti=onbellek.icerik_ozeti(ruya_metni),
+    )
+    db.add(yeni_ruya)
+    # Görsel prompt'u tembel üretimde henüz yok: ilk /resim/{id} isteğinde üretilip yazılır
+    if sonuc.get("gorsel_prompt"):
+        db.flush()
+        yeni_ruya.gorsel_prompt = sonuc["gorsel_prompt"]
+        yeni_ruya.resim_url = resim.kaynak_url_olustur(sonuc["gorsel_prompt"], resim.tohum(yeni_ruya.id))
+
+    db.commit()
+    return yeni_ruya.id, yeni_ruya.resim_url
+
+
+def _kaydedici(user_id: str, ruya_metni: str, taban_url: str):
+    """Aşama grafiğinin 'kaydet' adımı: rüyayı kaydeder, istemciye gidecek resim URL'ini döner."""
+    async def kaydet(sonuc: dict) -> dict:
+        ruya_id, kaynak_url = await db_calistir(_ruya_kaydet, user_id, ruya_metni, sonuc)
+        return {"id": ruya_id, "resim_url": resim.istemci_url(ruya_id, kaynak_url, taban_url)}
+    return kaydet
+
+
+def _analiz_cevabi(sonuc: dict) -> dict:
+    return {
+        "baslik": sonuc["baslik"],
+        "sonuc": sonuc["yorum"],
+        "resim_url": sonuc["kayit"]["resim_url"],
+        "duygu": sonuc["duygu"],
+        "id": sonuc["kayit"]["id"]
+    }
 
-        return {
-            "baslik": ruya_basligi, 
-            "sonuc": ai_cevabi, 
-            "resim_url": resim_url,
-            "duygu": ruya_duygusu,
-            "id": yeni_ruya.id
-        }
+
+def sse_olay(veri: dict, olay: str | None = None) -> str:
+    satirlar = f"event: {olay}\n" if olay else ""
+    return satirlar + f"data: {json.dumps(veri, ensure_ascii=False)}\n\n"
+
+
+def _analiz_istegini_dogrula(mod: str | None, ruya_metni: str):
+    # mod: "zincir" (3 çağrı) veya "tek" (tek JSON çağrı); boşsa ANALIZ_MODU kullanılır
+    if mod and mod not in analiz.ANALIZ_MODLARI:
+        raise HTTPException(status_code=400, detail="Geçersiz analiz modu")
+    # Boş/anlamsız girdi DB'ye ve modele gitmeden reddedilir
+    on_eleme.denetle(ruya_metni)
+    if not db_available:
+        raise HTTPException(status_code=503, detail="Veritabanı şu anda kullanılabilir değil")
+
+
+def _girdiyi_hazirla(ruya_metni: str, profil: dict) -> on_eleme.OnEleme:
+    """Modele gidecek metin: temizlenmiş ve üyeliğin girdi token bütçesine sığdırılmış.
+
+    Önbellek anahtarı da bu metinden üretilir; rüya kaydına kullanıcının yazdığı metin gider.
+    """
+    return on_eleme.sinirla(on_eleme.denetle(ruya_metni), llm.uyelik(profil["is_premium"]))
+
+
+def _taban_url(request: Request) -> str:
+    # /resim/{id} adresleri bu tabanla mutlak verilir (bkz. resim.istemci_url)
+    return str(request.base_url)
+
+
+async def analiz_yap(istek: RuyaIstegi, mod: str | None = None, taban_url: str = "") -> dict:
+    """/analiz-et ve iş (job) modunun ortak akışı: limit, önbellek, tek uçuş, aşama grafiği.
+
+    DB bağlantısı sadece kısa işlemlerde havuzdan alınır (db_calistir): profil okuma,
+    kota ayırma ve sondaki kayıt. Model çağrıları sürerken hiçbir oturum açık değildir;
+    eşzamanlı analiz sayısı artsa da havuz dolmaz (bkz. /metrics/db-havuz tutma_ms).
+    """
+    global analiz_devam_eden
+    analiz_devam_eden += 1
+    metrics.ayarla("analiz_devam_eden", analiz_devam_eden)
+    metrics.en_yuksek("analiz_devam_eden_tepe", analiz_devam_eden)
+    try:
+        # 1. KULLANICI: anahtar için profil (hak ayırmadan, kısa işlem)
+        profil = await db_calistir(kota.profil_getir, istek.user_id)
+        girdi = _girdiyi_hazirla(istek.ruya_metni, profil)
+        anahtar = onbellek.anahtar_olustur(girdi.metin, profil["interpreter_type"], profil["is_premium"], profil["zodiac"])
+
+        async def _analiz():
+            # 2. LİMİT: hak sadece analizi yapan (tek uçuşun lideri) için, tek koşullu UPDATE ile ayrılır.
+            # Çift gönderim liderin sonucuna katılır; son hakkını kullanan free kullanıcı 403 almaz.
+            ayrilan = await db_calistir(kota.ayir, istek.user_id)
+            harcandi = False
+            try:
+                # 3. ÖNBELLEK: Aynı rüya + yorumcu + üyelik + burç daha önce yorumlandıysa LLM'e gitme
+                onbellekten = await onbellek.getir(anahtar)
+                if onbellekten:
+                    sonuc = {**onbellekten, "kayit": await _kaydedici(istek.user_id, istek.ruya_metni, taban_url)(onbellekten)}
+                    harcandi = onbellek.ONBELLEK_KOTAYA_SAY
+                else:
+                    # 4. Aşama grafiği: yorum -> {başlık/duygu, görsel prompt} (paralel) -> kayıt
+                    # (yorumcu + üyelik modeli seçimi ve prompt analiz modülünde). Model aşamaları
+                    # bağlantı tutmaz; sadece 'kaydet' adımı kısa bir yazma işlemi açar.
+                    sonuc = await analiz.analiz_calistir(profil, girdi.metin, mod, kaydet=_kaydedici(istek.user_id, istek.ruya_metni, taban_url))
+                    harcandi = True
+                    onbellek.yaz(anahtar, sonuc)
+            finally:
+                # Hata ya da iptal: ayrılan hak geri verilir
+                if not harcandi:
+                    await kota.iade_et(ayrilan)
+
+            return _analiz_cevabi(sonuc)
+
+        # Aynı kullanıcının aynı rüyası için eşzamanlı istekler (çift gönderim) tek analizde birleşir
+        return await tek_ucus.calistir(tek_ucus.anahtar_olustur(istek.user_id, anahtar), _analiz)
 
     except HTTPException as he:
-        raise he 
+        raise he
+    except KapasiteAsimi as ka:
+        # Sınırlayıcı/devre kesici reddi: free önce 429 alır, devre açıksa 503
+        raise HTTPException(status_code=ka.status_code, detail=ka.detail, headers={"Retry-After": str(ka.retry_after)})
     except Exception as e:
         print(f"Analiz Hatası: {e}")
         raise HTTPException(status_code=500, detail=f"Sunucu hatası: {str(e)}")
-    
-    
-    
+    finally:
+        analiz_devam_eden -= 1
+        metrics.ayarla("analiz_devam_eden", analiz_devam_eden)
+
+
+@app.post("/analiz-et")
+async def analiz_et(istek: RuyaIstegi, request: Request, mod: str | None = None):
+    _analiz_istegini_dogrula(mod, istek.ruya_metni)
+    return await analiz_yap(istek, mod, _taban_url(request))
+
+
+# --- 2a. RÜYA ANALİZ (İŞ / JOB MODU) ---
+# POST hemen 202 + iş id'si döner; analiz sınırlı sayıda arka plan işçisinde
+# çalışır, sonuç GET /jobs/{id} ile yoklanır.
+@app.post("/analiz-et/jobs", status_code=202)
+async def analiz_isi_olustur(istek: RuyaIstegi, request: Request, mod: str | None = None):
+    _analiz_istegini_dogrula(mod, istek.ruya_metni)
+    # Limit hatası (403) iş kuyruğa girmeden dönsün (hak, iş çalışırken ayrılır)
+    await db_calistir(kota.on_kontrol, istek.user_id)
+    is_id = await isler.gonder(istek.user_id, {
+        "ruya_metni": istek.ruya_metni, "user_id": istek.user_id, "mod": mod, "taban_url": _taban_url(request),
+    })
+    return {"job_id": is_id, "durum": isler.BEKLIYOR}
+
+
+@app.get("/jobs/{is_id}")
+async def analiz_isi_getir(is_id: str):
+    if not db_available:
+        raise HTTPException(status_code=503, detail="Veritabanı şu anda kullanılabilir değil")
+    durum = await db_calistir(isler.is_getir, is_id)
+    if durum is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return durum
+
+
+async def _isi_calistir(veri: dict) -> dict:
+    istek = RuyaIstegi(ruya_metni=veri["ruya_metni"], user_id=veri["user_id"])
+    return await analiz_yap(istek, veri.get("mod"), veri.get("taban_url", ""))
+
+
+async def _onbellek_akisi(sonuc: dict, kaydet):
+    yield "parca", sonuc["yorum"]
+    yield "sonuc", {**sonuc, "kayit": await kaydet(sonuc)}
+
+
+def _son_olayi(cevap: dict) -> dict:
+    return {"baslik": cevap["baslik"], "duygu": cevap["duygu"], "resim_url": cevap["resim_url"], "id": cevap["id"]}
+
+
+async def _hazir_cevap_akisi(cevap: dict):
+    # Başka bir isteğin analizinden gelen sonuç: yorum tek parça
+    yield sse_olay({"parca": cevap["sonuc"]})
+    yield sse_olay(_son_olayi(cevap), olay="son")
+
+
+# --- 2b. RÜYA ANALİZ (SSE AKIŞI) ---
+# Yorum parçaları geldikçe "data:" olayı olarak gönderilir; kayıt bitince
+# başlık, duygu, resim URL'i ve rüya id'si "event: son" olayıyla gelir.
+@app.post("/analiz-et/stream")
+async def analiz_et_stream(istek: RuyaIstegi, request: Request):
+    _analiz_istegini_dogrula(None, istek.ruya_metni)
+    taban_url = _taban_url(request)
+
+    profil = await db_calistir(kota.profil_getir, istek.user_id)
+    girdi = _girdiyi_hazirla(istek.ruya_metni, profil)
+    anahtar = onbellek.anahtar_olustur(girdi.metin, profil["interpreter_type"], profil["is_premium"], profil["zodiac"])
+
+    async def olaylar():
+        global analiz_devam_eden
+        # Aynı rüyanın uçuştaki / az önce biten analizi (/analiz-et ya da akış) varsa onun sonucu akar;
+        # yoksa bu istek lider olur ve hak sadece lider için ayrılır (çift gönderim hak harcamaz)
+        mevcut, ucus = await tek_ucus.lider_ol(tek_ucus.anahtar_olustur(istek.user_id, anahtar))
+        if ucus is None:
+            yield None
+            async for olay in _hazir_cevap_akisi(mevcut):
+                yield olay
+            return
+
+        try:
+            ayrilan = await db_calistir(kota.ayir, istek.user_id)
+        except BaseException as e:
+            await ucus.birak(e)
+            raise
+
+        analiz_devam_eden += 1
+        metrics.ayarla("analiz_devam_eden", analiz_devam_eden)
+        harcandi = False
+        cevap = hata = None
+        try:
+            yield None
+            onbellekten = await onbellek.getir(anahtar)
+            if onbellekten:
+                # Önbellekteki yorum tek parça halinde gönderilir
+                akis = _onbellek_akisi(onbellekten, _kaydedici(istek.user_id, istek.ruya_metni, taban_url))
+            else:
+                akis = analiz.zincirleme_analiz_akis(profil, girdi.metin, kaydet=_kaydedici(istek.user_id, istek.ruya_metni, taban_url))
+
+            async for tur, veri in akis:
+                if tur == "parca":
+                    yield sse_olay({"parca": veri})
+                    continue
+
+                harcandi = onbellek.ONBELLEK_KOTAYA_SAY if onbellekten else True
+                if not onbellekten:
+                    onbellek.yaz(anahtar, veri)
+                cevap = _analiz_cevabi(veri)
+                yield sse_olay(_son_olayi(cevap), olay="son")
+        except KapasiteAsimi as ka:
+            hata = ka
+            yield sse_olay({"status_code": ka.status_code, "detail": ka.detail, "retry_after": ka.retry_after}, olay="hata")
+        except Exception as e:
+            hata = e
+            print(f"Analiz Akış Hatası: {e}")
+            yield sse_olay({"detail": f"Sunucu hatası: {str(e)}"}, olay="hata")
+        finally:
+            if cevap is not None:
+                await ucus.bitir(cevap)
+            else:
+                await ucus.birak(hata)
+            if not harcandi:
+                await kota.iade_et(ayrilan)
+            analiz_devam_eden -= 1
+            metrics.ayarla("analiz_devam_eden", analiz_devam_eden)
+
+    # İlk adım akış başlamadan çalışır: limit hatası (403) normal HTTP cevabı olarak dönsün.
+    # Başlamış üreteç yarıda bırakılsa da kapatılır (finally: hak iadesi, uçuşun bırakılması).
+    akis = olaylar()
+    try:
+        await akis.__anext__()
+    except HTTPException:
+        raise
+    except KapasiteAsimi as ka:
+        raise HTTPException(status_code=ka.status_code, detail=ka.detail, headers={"Retry-After": str(ka.retry_after)})
+    except Exception as e:
+        print(f"Analiz Akış Hatası: {e}")
+        raise HTTPException(status_code=500, detail=f"Sunucu hatası: {str(e)}")
+
+    return StreamingResponse(
+        akis,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+
     # --- 3. GEÇMİŞ RÜYALAR ---
+# Sayfalı (keyset: user_id + (created_at, id) azalan, ix_ruyalar_user_created_id
+# indeksinde aralık taraması) ve özet projeksiyonlu liste; büyük Text
+# kolonları (ruya_metni, yorum) sadece 'fields' ile istenirse okunur.
+# Cevap eskisi gibi rüya listesidir; sonraki sayfa varsa imleç X-Sonraki-Imlec
+# başlığında (ve Link: <...>; rel="next") gelir, 'imlec' olarak geri gönderilir.
+# Tam metin için /ruya/{id}.
+
+GECMIS_OZET_ALANLARI = ("id", "baslik", "duygu", "tarih", "resim_url")
+GECMIS_ALANLARI = GECMIS_OZET_ALANLARI + ("user_id", "ruya_metni", "yorum", "gorsel_prompt", "created_at")
+GECMIS_VARSAYILAN_LIMIT = 20
+GECMIS_EN_COK_LIMIT = 100
+
+
+def _imlec_olustur(satir) -> str:
+    veri = {"c": satir.created_at.isoformat(), "id": satir.id}
+    return base64.urlsafe_b64encode(json.dumps(veri).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _imlec_coz(imlec: str) -> tuple[datetime, int]:
+    try:
+        veri = json.loads(base64.urlsafe_b64decode(imlec + "=" * (-len(imlec) % 4)))
+        return datetime.fromisoformat(veri["c"]), int(veri["id"])
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Geçersiz imleç")
+
+
+def _alanlari_coz(fields: str | None) -> tuple[str, ...]:
+    if not fields:
+        return GECMIS_OZET_ALANLARI
+    alanlar = tuple(dict.fromkeys(a.strip() for a in fields.split(",") if a.strip()))
+    bilinmeyen = [a for a in alanlar if a not in GECMIS_ALANLARI]
+    if bilinmeyen or not alanlar:
+        raise HTTPException(status_code=400, detail=f"Geçersiz alan: {', '.join(bilinmeyen) or '-'}")
+    return alanlar
+
+
+def _ruya_sozlugu(satir, alanlar: tuple[str, ...], taban_url: str) -> dict:
+    veri = {alan: getattr(satir, alan) for alan in alanlar}
+    if "resim_url" in veri:
+        # İstemciye kaynak URL yerine proxy adresi (prompt henüz üretilmediyse de)
+        veri["resim_url"] = resim.istemci_url(satir.id, satir.resim_url, taban_url)
+    return veri
+
 
 @app.get("/gecmis")
-def gecmis_getir(user_id: str, db: Session = Depends(get_db)):
-    ruyalar = db.query(models.Ruya).filter(models.Ruya.user_id == user_id).all()
-    return ruyalar
+def gecmis_getir(user_id: str, request: Request, response: Response, limit: int = GECMIS_VARSAYILAN_LIMIT,
+                 imlec: str | None = None, fields: str | None = None, db: Session = Depends(get_db)):
+    R = models.Ruya
+    alanlar = _alanlari_coz(fields)
+    limit = max(1, min(limit, GECMIS_EN_COK_LIMIT))
+    # id ve created_at her zaman okunur (imleç ve resim_url için)
+    kolonlar = [getattr(R, a) for a in dict.fromkeys(("id", "created_at", *alanlar))]
+
+    sorgu = select(*kolonlar).where(R.user_id == user_id)
+    if imlec:
+        sorgu = sorgu.where(tuple_(R.created_at, R.id) < tuple_(*_imlec_coz(imlec)))
+    # Bir fazlası: sonraki sayfa var mı?
+    satirlar = db.execute(sorgu.order_by(R.created_at.desc(), R.id.desc()).limit(limit + 1)).all()
+
+    if len(satirlar) > limit:
+        sonraki = _imlec_olustur(satirlar[limit - 1])
+        response.headers["X-Sonraki-Imlec"] = sonraki
+        response.headers["Link"] = f'<{request.url.include_query_params(imlec=sonraki)}>; rel="next"'
+    return [_ruya_sozlugu(satir, alanlar, _taban_url(request)) for satir in satirlar[:limit]]
+
+
+@app.get("/ruya/{ruya_id}")
+def ruya_getir(ruya_id: int, user_id: str, request: Request, db: Session = Depends(get_db)):
+    R = models.Ruya
+    satir = db.execute(select(*[getattr(R, a) for a in GECMIS_ALANLARI]).where(R.id == ruya_id)).first()
+    # Başka kullanıcının rüyası da 404 (varlığı belli olmasın)
+    if satir is None or satir.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return _ruya_sozlugu(satir, GECMIS_ALANLARI, _taban_url(request))
 
 # --- 4. RÜYA SİLME ---
 
@@ -351,6 +595,102 @@ def ruya_sil(id: int, db: Session = Depends(get_db)):
     db.commit()
     return {"mesaj": "Deleted"}
 
+# --- 4a. RÜYA GÖRSELİ (PROXY + DİSK ÖNBELLEĞİ) ---
+# Görsel kaynaktan bir kez indirilir, sonra diskten verilir; içerik özetiyle
+# güçlü ETag ve uzun Cache-Control (If-None-Match eşleşirse 304).
+# Görsel prompt'u analizde üretilmez: rüyanın görseli ilk istendiğinde üretilip
+# satıra yazılır, sonraki istekler kayıtlı prompt'u kullanır. İlk üretim yalnızca
+# istemciye verilen imzalı adresle (?imza=, bkz. resim.istemci_url) tetiklenir.
+
+def _resim_bilgisi(db: Session, ruya_id: int) -> dict | None:
+    ruya = db.query(models.Ruya).filter(models.Ruya.id == ruya_id).first()
+    if ruya is None:
+        return None
+    # Kayıtlı kaynak URL olduğu gibi kullanılır: eski kayıtların seed'i rastgeleydi,
+    # id'den yeniden türetmek var olan görseli değiştirirdi
+    if ruya.resim_url:
+        return {"kaynak_url": ruya.resim_url, "gorsel_prompt": ruya.gorsel_prompt}
+    if ruya.gorsel_prompt:
+        return {"kaynak_url": None, "gorsel_prompt": ruya.gorsel_prompt}
+
+    user_profile = db.query(models.UserProfile).filter(models.UserProfile.user_id == ruya.user_id).first()
+    return {
+        "kaynak_url": None,
+        "gorsel_prompt": None,
+        "ruya_metni": ruya.ruya_metni,
+        "yorum": ruya.yorum,
+        "profil": {
+            "user_id": ruya.user_id,
+            "is_premium": bool(user_profile and user_profile.is_premium),
+            "interpreter_type": (user_profile and user_profile.interpreter_type) or "psychological",
+            "zodiac": (user_profile and user_profile.zodiac) or "Unknown",
+        },
+    }
+
+def _gorsel_prompt_yaz(db: Session, ruya_id: int, gorsel_prompt: str) -> str:
+    """İlk yazan kazanır (başka worker da üretmiş olabilir); kayıtlı prompt'u döner."""
+    db.query(models.Ruya).filter(models.Ruya.id == ruya_id, models.Ruya.gorsel_prompt.is_(None)).update(
+        {"gorsel_prompt": gorsel_prompt, "resim_url": resim.kaynak_url_olustur(gorsel_prompt, resim.tohum(ruya_id))},
+        synchronize_session=False,
+    )
+    db.commit()
+    return db.query(models.Ruya.gorsel_prompt).filter(models.Ruya.id == ruya_id).scalar() or gorsel_prompt
+
+async def _gorsel_prompt_hazirla(ruya_id: int, bilgi: dict) -> str:
+    metrics.artir("gorsel_prompt_tembel_uretim")
+    gorsel_prompt = await analiz.gorsel_prompt_uret(bilgi["profil"], bilgi["ruya_metni"], bilgi["yorum"])
+    return await db_calistir(_gorsel_prompt_yaz, ruya_id, gorsel_prompt)
+
+@app.get("/resim/{ruya_id}")
+async def resim_getir(ruya_id: int, request: Request, imza: str | None = None):
+    if not db_available:
+        raise HTTPException(status_code=503, detail="Veritabanı şu anda kullanılabilir değil")
+    bilgi = await db_calistir(_resim_bilgisi, ruya_id)
+    if bilgi is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    kaynak_url, gorsel_prompt = bilgi["kaynak_url"], bilgi["gorsel_prompt"]
+    if not kaynak_url and not gorsel_prompt:
+        # Tembel üretim LLM çağrısıdır: yalnızca bizim verdiğimiz imzalı adresle
+        if not resim.imza_gecerli(ruya_id, imza):
+            raise HTTPException(status_code=403, detail="Geçersiz görsel imzası")
+        try:
+            # Aynı rüyanın görseline eşzamanlı ilk istekler tek üretimde birleşir
+            gorsel_prompt = await resim.tek_sefer(f"prompt:{ruya_id}", lambda: _gorsel_prompt_hazirla(ruya_id, bilgi))
+        except KapasiteAsimi as ka:
+            raise HTTPException(status_code=ka.status_code, detail=ka.detail, headers={"Retry-After": str(ka.retry_after)})
+        except Exception as e:
+            print(f"⚠️ Görsel prompt'u üretilemedi (rüya {ruya_id}): {e}")
+            raise HTTPException(status_code=502, detail="Görsel şu anda hazırlanamıyor")
+
+    try:
+        # Yeni kayıtlarda seed id'den türetilir (tembel üretimde de kaynak URL böyle yazılır)
+        dosya = await resim.getir(kaynak_url or resim.kaynak_url_olustur(gorsel_prompt, resim.tohum(ruya_id)))
+    except resim.ResimHatasi as e:
+        print(f"⚠️ Görsel alınamadı (rüya {ruya_id}): {e}")
+        raise HTTPException(status_code=502, detail="Görsel şu anda alınamıyor")
+
+    basliklar = {"ETag": dosya.etag, "Cache-Control": f"public, max-age={resim.RESIM_MAX_AGE_SN}"}
+    if dosya.etag in [e.strip() for e in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=basliklar)
+    return FileResponse(dosya.yol, media_type=dosya.tur, headers=basliklar)
+
+# --- 5. MODEL KULLANIM RAPORU ---
+# Persona/üyelik/aşama başına token toplamları ve p50/p95 gecikme
+
+@app.get("/kullanim/gunluk")
+def kullanim_gunluk(gun_sayisi: int = 7, db: Session = Depends(get_db)):
+    return kullanim.ozet(db, "gunluk", gun_sayisi)
+
+@app.get("/kullanim/persona")
+def kullanim_persona(gun_sayisi: int = 7, db: Session = Depends(get_db)):
+    return kullanim.ozet(db, "persona", gun_sayisi)
+
+# Model rotası (üyelik, aşama, model) başına: rota eşlemesini ayarlamak için
+@app.get("/kullanim/rota")
+def kullanim_rota(gun_sayisi: int = 7, db: Session = Depends(get_db)):
+    return kullanim.ozet(db, "rota", gun_sayisi)
+
 # --- SUNUCUYU BAŞLAT ---
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
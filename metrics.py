@@ -0,0 +1,122 @@
+import time
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# --- Basit süreç içi metrik kaydı ---
+# Sayaçlar (artan), anlık değerler (gauge), gecikme dağılımları (son N gözlem)
+# ve kayan pencereler (son PENCERE_SN saniyedeki olay sayısı, saniyelik dilimlerle).
+# /metrics endpoint'i ozet() çıktısını JSON olarak döndürür.
+
+DAGILIM_PENCERESI = 2000
+PENCERE_SN = 60
+
+_kilit = threading.Lock()
+_sayaclar: dict[str, float] = defaultdict(float)
+_degerler: dict[str, float] = {}
+_dagilimlar: dict[str, deque] = defaultdict(lambda: deque(maxlen=DAGILIM_PENCERESI))
+_pencereler: dict[str, deque] = defaultdict(deque)  # [saniye, adet] dilimleri
+
+
+def artir(ad: str, miktar: float = 1) -> None:
+    with _kilit:
+        _sayaclar[ad] += miktar
+
+
+def sayac(ad: str) -> float:
+    with _kilit:
+        return _sayaclar.get(ad, 0)
+
+
+def ayarla(ad: str, deger: float) -> None:
+    with _kilit:
+        _degerler[ad] = deger
+
+
+def en_yuksek(ad: str, deger: float) -> None:
+    """Değeri sadece öncekinden büyükse günceller (tepe değer takibi)."""
+    with _kilit:
+        if deger > _degerler.get(ad, float("-inf")):
+            _degerler[ad] = deger
+
+
+def gozlem(ad: str, deger: float) -> None:
+    with _kilit:
+        _dagilimlar[ad].append(deger)
+
+
+def _pencere_kirp(dilimler: deque, simdi: int) -> None:
+    while dilimler and dilimler[0][0] <= simdi - PENCERE_SN:
+        dilimler.popleft()
+
+
+def pencere_artir(ad: str, miktar: float = 1) -> None:
+    """Kayan pencere sayacı: ozet()'te son PENCERE_SN saniyedeki toplam olarak görünür."""
+    simdi = int(time.monotonic())
+    with _kilit:
+        dilimler = _pencereler[ad]
+        if dilimler and dilimler[-1][0] == simdi:
+            dilimler[-1][1] += miktar
+        else:
+            dilimler.append([simdi, miktar])
+        _pencere_kirp(dilimler, simdi)
+
+
+def gozlem_sayisi(ad: str) -> int:
+    with _kilit:
+        return len(_dagilimlar.get(ad, ()))
+
+
+def yuzdelik(ad: str, oran: float) -> float | None:
+    """Son gözlemlerden yüzdelik değer (oran: 0-1 arası). Gözlem yoksa None."""
+    with _kilit:
+        veriler = sorted(_dagilimlar.get(ad, ()))
+    if not veriler:
+        return None
+    sira = min(len(veriler) - 1, int(oran * len(veriler)))
+    return veriler[sira]
+
+
+@contextmanager
+def sure_olc(ad: str):
+    """Bloğun süresini milisaniye olarak 'ad' dağılımına ekler."""
+    baslangic = time.perf_counter()
+    try:
+        yield
+    finally:
+        gozlem(ad, (time.perf_counter() - baslangic) * 1000)
+
+
+def ozet() -> dict:
+    with _kilit:
+        sayaclar = dict(_sayaclar)
+        degerler = dict(_degerler)
+        dagilimlar = {ad: sorted(d) for ad, d in _dagilimlar.items() if d}
+        simdi = int(time.monotonic())
+        pencereler = {}
+        for ad, dilimler in _pencereler.items():
+            _pencere_kirp(dilimler, simdi)
+            if dilimler:
+                pencereler[ad] = sum(adet for _, adet in dilimler)
+
+    def _yuzde(veriler, oran):
+        return round(veriler[min(len(veriler) - 1, int(oran * len(veriler)))], 2)
+
+    return {
+        "sayaclar": sayaclar,
+        "degerler": degerler,
+        "dagilimlar": {
+            ad: {
+                "adet": len(v),
+                "p50": _yuzde(v, 0.50),
+                "p90": _yuzde(v, 0.90),
+                "p95": _yuzde(v, 0.95),
+                "p99": _yuzde(v, 0.99),
+            }
+            for ad, v in dagilimlar.items()
+        },
+        "pencereler": {
+            ad: {f"son_{PENCERE_SN}sn": adet, "saniyede": round(adet / PENCERE_SN, 2)}
+            for ad, adet in pencereler.items()
+        },
+    }
@@ -0,0 +1,222 @@
+"""Sürümlü şema migrasyonları (SQLite / Postgres / MySQL).
+
+Başlangıçta create_all'dan sonra calistir() çağrılır: sema_surumleri tablosunda
+kaydı olmayan migrasyonlar sürüm sırasıyla, her biri kendi işleminde uygulanır
+ve sürüm satırı aynı işlemde yazılır. Böylece mevcut veri silinmeden (drop_all
+olmadan) kolon/indeks eklenir ve eski satırlar doldurulur.
+
+create_all yeni kurulumda tabloları modellerin son haliyle açar; bu yüzden
+kolon_ekle()/indeks_ekle() var olanı atlar, migrasyonlar her iki durumda da
+(boş ya da eski veritabanı) güvenle çalışır.
+
+Aynı anda başlayan worker'lar:
+  Postgres/MySQL: tüm çalıştırma bir advisory lock altında (pg_advisory_lock / GET_LOCK).
+  SQLite: sürüm satırı işlemin ilk yazımıdır; yazma kilidi diğerini bekletir,
+          bekleyen işlem sürüm satırında çakışınca (IntegrityError) migrasyonu atlar.
+MySQL'de DDL örtük commit yapar; orada yarıda kalan migrasyon bir sonraki
+başlangıçta tekrar denenir (adımlar var olanı atladığı için tekrar çalışabilir).
+
+Yeni migrasyon: sıradaki sürüm numarasıyla @migrasyon(...) altında bir fonksiyon
+(conn -> None) yazılır; yayınlanmış migrasyon sonradan değiştirilmez.
+
+Elle çalıştırma / durum:
+    python migrasyon.py
+    python migrasyon.py --durum
+"""
+import sys
+import argparse
+from datetime import datetime
+from contextlib import contextmanager
+
+from sqlalchemy import bindparam, insert, inspect, select, text, update
+from sqlalchemy.exc import IntegrityError
+
+import models
+import onbellek
+
+MIGRASYONLAR: list[tuple[int, str, object]] = []
+DOLDURMA_PARTISI = 1000
+KILIT_ADI = "ruya_sema_migrasyonu"
+KILIT_ZAMAN_ASIMI_SN = 300
+# tarih metni okunamayan eski kayıtlar: sıralamada en eskiye düşsünler
+BILINMEYEN_TARIH = datetime(1970, 1, 1)
+
+
+def migrasyon(surum: int, ad: str):
+    def kaydet(fn):
+        if any(s == surum for s, _, _ in MIGRASYONLAR):
+            raise ValueError(f"Aynı sürüm iki kez tanımlandı: {surum}")
+        MIGRASYONLAR.append((surum, ad, fn))
+        return fn
+    return kaydet
+
+
+# --- YARDIMCILAR ---
+
+def kolon_ekle(conn, kolon) -> bool:
+    """Model kolonunu (nullable) tabloya ekler; zaten varsa dokunmaz."""
+    tablo = kolon.table.name
+    if kolon.name in {k["name"] for k in inspect(conn).get_columns(tablo)}:
+        return False
+    tirnak = conn.dialect.identifier_preparer.quote
+    tip = kolon.type.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {tirnak(tablo)} ADD COLUMN {tirnak(kolon.name)} {tip}"))
+    print(f"🛠️ Kolon eklendi: {tablo}.{kolon.name}")
+    return True
+
+
+def indeks_ekle(conn, indeks) -> bool:
+    """Modelde tanımlı indeksi oluşturur; aynı adla varsa dokunmaz."""
+    if indeks.name in {i["name"] for i in inspect(conn).get_indexes(indeks.table.name)}:
+        return False
+    indeks.create(bind=conn)
+    print(f"🛠️ İndeks eklendi: {indeks.name}")
+    return True
+
+
+def _indeks(tablo, ad: str):
+    return next(i for i in tablo.indexes if i.name == ad)
+
+
+def partilerle_doldur(conn, tablo, bos_kolon, okunacaklar, hesapla) -> int:
+    """bos_kolon'u NULL olan satırları id sırasıyla partiler halinde doldurur.
+
+    hesapla(satir) -> bos_kolon'un yeni değeri. Doldurulan satır sayısını döner.
+    """
+    ifade = (
+        update(tablo)
+        .where(tablo.c.id == bindparam("_id"))
+        .values({bos_kolon.name: bindparam("_deger")})
+    )
+    son_id, toplam = 0, 0
+    while True:
+        satirlar = conn.execute(
+            select(tablo.c.id, *okunacaklar)
+            .where(bos_kolon.is_(None), tablo.c.id > son_id)
+            .order_by(tablo.c.id)
+            .limit(DOLDURMA_PARTISI)
+        ).all()
+        if not satirlar:
+            break
+        conn.execute(ifade, [{"_id": s.id, "_deger": hesapla(s)} for s in satirlar])
+        son_id = satirlar[-1].id
+        toplam += len(satirlar)
+    if toplam:
+        print(f"🛠️ {tablo.name}.{bos_kolon.name}: {toplam} satır dolduruldu")
+    return toplam
+
+
+# --- MİGRASYONLAR ---
+
+R = models.Ruya.__table__
+
+
+@migrasyon(1, "onceki_nullable_kolonlar")
+def _onceki_kolonlar(conn):
+    # Eskiden başlangıçta otomatik eklenen kolonlar (database.eksik_kolonlari_ekle)
+    kolon_ekle(conn, R.c.gorsel_prompt)
+    kolon_ekle(conn, models.ModelKullanimi.__table__.c.tahmini_girdi_token)
+
+
+def _tarihten_zaman(satir) -> datetime:
+    try:
+        return datetime.strptime((satir.tarih or "").strip(), "%d.%m.%Y")
+    except ValueError:
+        return BILINMEYEN_TARIH
+
+
+@migrasyon(2, "ruya_created_at")
+def _ruya_created_at(conn):
+    # tarih "%d.%m.%Y" metni sıralanamaz; eski kayıtlar gün başına yerleşir, gün içi sıra id'den
+    kolon_ekle(conn, R.c.created_at)
+    partilerle_doldur(conn, R, R.c.created_at, (R.c.tarih,), _tarihten_zaman)
+
+
+@migrasyon(3, "ruya_gecmis_indeksi")
+def _ruya_gecmis_indeksi(conn):
+    indeks_ekle(conn, _indeks(R, "ix_ruyalar_user_created_id"))
+
+
+@migrasyon(4, "ruya_icerik_ozeti")
+def _ruya_icerik_ozeti(conn):
+    kolon_ekle(conn, R.c.icerik_ozeti)
+    partilerle_doldur(conn, R, R.c.icerik_ozeti, (R.c.ruya_metni,),
+                      lambda satir: onbellek.icerik_ozeti(satir.ruya_metni or ""))
+    indeks_ekle(conn, _indeks(R, "ix_ruyalar_user_icerik"))
+
+
+# --- ÇALIŞTIRICI ---
+
+@contextmanager
+def _kilit(engine):
+    ad = engine.dialect.name
+    if ad not in ("postgresql", "mysql", "mariadb"):
+        yield
+        return
+    with engine.connect() as conn:
+        if ad == "postgresql":
+            conn.execute(text("SELECT pg_advisory_lock(hashtext(:ad))"), {"ad": KILIT_ADI})
+        elif conn.execute(text("SELECT GET_LOCK(:ad, :sn)"), {"ad": KILIT_ADI, "sn": KILIT_ZAMAN_ASIMI_SN}).scalar() != 1:
+            raise RuntimeError("Migrasyon kilidi alınamadı (başka bir süreç çalıştırıyor olabilir)")
+        conn.commit()
+        try:
+            yield
+        finally:
+            if ad == "postgresql":
+                conn.execute(text("SELECT pg_advisory_unlock(hashtext(:ad))"), {"ad": KILIT_ADI})
+            else:
+                conn.execute(text("SELECT RELEASE_LOCK(:ad)"), {"ad": KILIT_ADI})
+            conn.commit()
+
+
+def uygulananlar(engine) -> set[int]:
+    S = models.SemaSurumu
+    with engine.connect() as conn:
+        return set(conn.execute(select(S.surum)).scalars())
+
+
+def calistir(engine) -> list[int]:
+    """Bekleyen migrasyonları sırayla uygular; uygulananların sürümlerini döner."""
+    S = models.SemaSurumu
+    S.__table__.create(bind=engine, checkfirst=True)
+    yapilan = []
+    with _kilit(engine):
+        for surum, ad, fn in sorted(MIGRASYONLAR, key=lambda m: m[0]):
+            with engine.connect() as conn:
+                if conn.execute(select(S.surum).where(S.surum == surum)).first() is not None:
+                    continue
+                try:
+                    conn.execute(insert(S).values(surum=surum, ad=ad, uygulama=datetime.utcnow()))
+                except IntegrityError:
+                    # Aynı anda başlayan başka bir worker bu sürümü uyguladı
+                    conn.rollback()
+                    continue
+                # Hata olursa bağlantı kapanırken sürüm satırıyla birlikte geri alınır
+                fn(conn)
+                conn.commit()
+            print(f"✅ Migrasyon {surum} uygulandı: {ad}")
+            yapilan.append(surum)
+    return yapilan
+
+
+def ana(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Şema migrasyonları")
+    p.add_argument("--durum", action="store_true", help="Uygulanan/bekleyen sürümleri listele, uygulama")
+    args = p.parse_args(argv)
+
+    from database import engine
+
+    models.Base.metadata.create_all(bind=engine)
+    if args.durum:
+        models.SemaSurumu.__table__.create(bind=engine, checkfirst=True)
+        yapilmis = uygulananlar(engine)
+        for surum, ad, _ in sorted(MIGRASYONLAR, key=lambda m: m[0]):
+            print(f"{'✅' if surum in yapilmis else '⏳'} {surum:>3} {ad}")
+        return 0
+    yapilan = calistir(engine)
+    print(f"🗄️ {engine.dialect.name}: {len(yapilan)} migrasyon uygulandı" if yapilan else "🗄️ Şema güncel")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(ana())
@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, Text
+from sqlalchemy import Column, Integer, String, Text, Float, Index
 from database import Base
-from sqlalchemy import Boolean, Date
+from sqlalchemy import Boolean, Date, DateTime
 import datetime # <--- Bu satır eklendi (Tarih işlemleri için)
 
 
@@ -15,6 +15,18 @@ class Ruya(Base):
     resim_url = Column(Text, nullable=True) # <--- YENİ EKLENDİ
     duygu = Column(Text, nullable=True)  # <--- YENİ EKLENDİ
     tarih = Column(String(50), nullable=True)
+    # Görsel prompt'u görsel ilk istendiğinde üretilip buraya yazılır (bkz. /resim/{id})
+    gorsel_prompt = Column(Text, nullable=True)
+    # Sıralanabilir kayıt zamanı (tarih "%d.%m.%Y" metni; eski kayıtlar ondan dolduruldu, bkz. migrasyon.py)
+    created_at = Column(DateTime, nullable=True, default=datetime.datetime.utcnow)
+    # Normalize edilmiş rüya metninin sha256 özeti (aynı rüyanın tekrarlarını bulmak için)
+    icerik_ozeti = Column(String(64), nullable=True)
+
+    __table_args__ = (
+        # /gecmis: kullanıcının rüyaları (created_at, id) azalan sırayla, keyset sayfalama
+        Index("ix_ruyalar_user_created_id", "user_id", "created_at", "id"),
+        Index("ix_ruyalar_user_icerik", "user_id", "icerik_ozeti"),
+    )
 
 class UserProfile(Base):
     __tablename__ = 'user_profiles'
@@ -33,4 +45,84 @@ class UserProfile(Base):
     # --------------------
     # (Eski günlük sayaçları isterseniz tutabilir veya silebilirsiniz, şimdilik kalsın)
     daily_usage_count = Column(Integer, default=0) 
-    last_usage_date = Column(Date, default=datetime.date.today)
\ No newline at end of file
+    last_usage_date = Column(Date, default=datetime.date.today)
+
+# --- YORUM ÖNBELLEĞİ (2. katman) ---
+# anahtar: normalize rüya metni + yorumcu + premium + burç özeti (sha256 hex)
+class AnalizOnbellek(Base):
+    __tablename__ = 'analiz_onbellek'
+
+    id = Column(Integer, primary_key=True, index=True)
+    anahtar = Column(String(64), unique=True, index=True, nullable=False)
+    sonuc = Column(Text, nullable=False) # JSON: yorum, baslik, duygu, gorsel_prompt
+    olusturma = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+
+# --- TEK UÇUŞ KİRASI ---
+# Aynı kullanıcı + rüya için worker'lar arası eşzamanlı analiz kilidi; biten analizin sonucu kısa süre burada kalır
+class AnalizKirasi(Base):
+    __tablename__ = 'analiz_kiralari'
+
+    id = Column(Integer, primary_key=True, index=True)
+    anahtar = Column(String(64), unique=True, index=True, nullable=False)
+    sahip = Column(String(32), nullable=False)
+    bitis = Column(DateTime, nullable=False)
+    sonuc = Column(Text, nullable=True) # JSON: /analiz-et cevabı
+
+
+# --- ŞEMA SÜRÜMLERİ (migrasyon.py) ---
+# Uygulanan her migrasyon için bir satır; sürüm numarası birincil anahtar
+class SemaSurumu(Base):
+    __tablename__ = 'sema_surumleri'
+
+    surum = Column(Integer, primary_key=True, autoincrement=False)
+    ad = Column(String(100), nullable=False)
+    uygulama = Column(DateTime, nullable=False)
+
+
+# --- İSTEK SINIRI KOVALARI (ISTEK_SINIRI_DEPO=db) ---
+# anahtar: kural:kapsam:değer (ör. analiz:ip:1.2.3.4); guncelleme: epoch saniye (worker'lar arası ortak saat)
+class IstekKovasi(Base):
+    __tablename__ = 'istek_kovalari'
+
+    id = Column(Integer, primary_key=True, index=True)
+    anahtar = Column(String(200), unique=True, index=True, nullable=False)
+    jeton = Column(Float, nullable=False)
+    guncelleme = Column(Float, index=True, nullable=False)
+
+
+# --- ANALİZ İŞLERİ (JOB MODU) ---
+# durum: 'bekliyor' -> 'calisiyor' -> 'tamamlandi' | 'hata'
+class AnalizIsi(Base):
+    __tablename__ = 'analiz_isleri'
+
+    id = Column(String(32), primary_key=True)
+    user_id = Column(String(100), index=True)
+    durum = Column(String(20), index=True, nullable=False)
+    istek = Column(Text, nullable=False) # JSON: ruya_metni, user_id, mod
+    sonuc = Column(Text, nullable=True)  # JSON: /analiz-et cevabı
+    hata = Column(Text, nullable=True)   # JSON: status_code, detail
+    olusturma = Column(DateTime, default=datetime.datetime.utcnow)
+    baslama = Column(DateTime, nullable=True)
+    bitis = Column(DateTime, nullable=True)
+
+
+# --- MODEL KULLANIM KAYDI (sadece ekleme yapılır) ---
+# Her Gemini çağrısı: aşama, persona, üyelik, token sayıları, gecikme ve sonuç
+class ModelKullanimi(Base):
+    __tablename__ = 'model_kullanimi'
+
+    id = Column(Integer, primary_key=True, index=True)
+    zaman = Column(DateTime, nullable=False)
+    gun = Column(Date, index=True, nullable=False)
+    user_id = Column(String(100), nullable=True)
+    asama = Column(String(50), nullable=False)   # yorum, baslik_duygu, gorsel, tek, yorum_akis
+    yorumcu = Column(String(50), nullable=True)
+    uyelik = Column(String(20), nullable=True)   # premium / free
+    model = Column(String(100), nullable=True)
+    girdi_token = Column(Integer, default=0)
+    cikti_token = Column(Integer, default=0)
+    tahmini_girdi_token = Column(Integer, nullable=True)  # ön elemedeki karakter tabanlı tahmin
+    gecikme_ms = Column(Float, nullable=False)
+    sonuc = Column(String(20), nullable=False)   # basarili, hata, iptal
@@ -0,0 +1,80 @@
+import os
+import math
+import unicodedata
+from dataclasses import dataclass
+
+from fastapi import HTTPException
+
+import metrics
+
+# --- GİRDİ ÖN ELEMESİ (model çağrılarından önce) ---
+# 1. denetle(): Boş / metin olmayan / anlamsız girdiyi DB'ye ve modele gitmeden 400 ile reddeder.
+# 2. sinirla(): Tokenı ucuz yoldan (karakter sayısı) tahmin eder; üyeliğin girdi
+#    bütçesini aşan metni baştan ve sondan koruyarak kırpar (özetleme ek bir model
+#    çağrısı gerektireceği için yapılmaz). Tahmin kullanım kaydına ve sınırlayıcının
+#    maliyet ağırlığına gider.
+
+GIRDI_EN_COK_KARAKTER = int(os.getenv("GIRDI_EN_COK_KARAKTER", "20000"))  # üstü 422 (istek şeması)
+GIRDI_EN_AZ_HARF = int(os.getenv("GIRDI_EN_AZ_HARF", "3"))
+GIRDI_EN_AZ_HARF_ORANI = float(os.getenv("GIRDI_EN_AZ_HARF_ORANI", "0.5"))
+GIRDI_TOKEN_BUTCESI = {
+    "premium": int(os.getenv("PREMIUM_GIRDI_TOKEN", "1500")),
+    "free": int(os.getenv("FREE_GIRDI_TOKEN", "400")),
+}
+# Kaba tahmin: Türkçe/İngilizce metinde ~3.5 karakter / token
+KARAKTER_BASINA_TOKEN = 1 / float(os.getenv("TOKEN_BASINA_KARAKTER", "3.5"))
+KIRPMA_ISARETI = " […] "
+KIRPMA_BAS_ORANI = 0.7  # kırpılırken korunacak kısmın baştan gelen payı
+
+
+@dataclass
+class OnEleme:
+    metin: str
+    tahmini_token: int
+    orijinal_token: int
+    kirpildi: bool
+
+
+def token_tahmini(metin: str) -> int:
+    return math.ceil(len(metin) * KARAKTER_BASINA_TOKEN)
+
+
+def denetle(ruya_metni: str) -> str:
+    """Kontrol karakterlerini atar, boşlukları sadeleştirir; anlamsız girdide 400 fırlatır."""
+    temiz = "".join(
+        " " if unicodedata.category(k).startswith(("C", "Z")) else k
+        for k in unicodedata.normalize("NFC", ruya_metni)
+    )
+    temiz = " ".join(temiz.split())
+    if not temiz:
+        metrics.artir("on_eleme_red.bos")
+        raise HTTPException(status_code=400, detail="EMPTY_DREAM")
+
+    harfler = [k for k in temiz if k.isalpha()]
+    gorunur = sum(1 for k in temiz if not k.isspace())
+    if (
+        len(harfler) < GIRDI_EN_AZ_HARF
+        or len(set(k.casefold() for k in harfler)) < GIRDI_EN_AZ_HARF
+        or len(harfler) / gorunur < GIRDI_EN_AZ_HARF_ORANI
+    ):
+        # Sadece rakam/emoji/noktalama ya da "aaaaaa" gibi tekrar
+        metrics.artir("on_eleme_red.anlamsiz")
+        raise HTTPException(status_code=400, detail="INVALID_DREAM")
+    return temiz
+
+
+def sinirla(metin: str, uyelik: str) -> OnEleme:
+    """Metni üyeliğin girdi token bütçesine sığdırır (kelime sınırından, baş + son korunarak)."""
+    orijinal_token = token_tahmini(metin)
+    metrics.gozlem(f"girdi_token_tahmini.{uyelik}", orijinal_token)
+    butce = GIRDI_TOKEN_BUTCESI[uyelik]
+    if orijinal_token <= butce:
+        return OnEleme(metin, orijinal_token, orijinal_token, False)
+
+    karakter = int(butce / KARAKTER_BASINA_TOKEN) - len(KIRPMA_ISARETI)
+    bas_uzunluk = int(karakter * KIRPMA_BAS_ORANI)
+    bas = metin[:bas_uzunluk].rsplit(" ", 1)[0]
+    son = metin[len(metin) - (karakter - bas_uzunluk):].split(" ", 1)[-1]
+    kirpilmis = bas + KIRPMA_ISARETI + son
+    metrics.artir(f"on_eleme_kirpilan.{uyelik}")
+    return OnEleme(kirpilmis, token_tahmini(kirpilmis), orijinal_token, True)
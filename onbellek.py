@@ -0,0 +1,122 @@
+import os
+import json
+import asyncio
+import hashlib
+import unicodedata
+from datetime import datetime, timedelta
+
+from cachetools import TTLCache
+from sqlalchemy.exc import IntegrityError
+
+import models
+import metrics
+from database import db_calistir
+
+# --- İKİ KATMANLI YORUM ÖNBELLEĞİ ---
+# 1. katman: Süreç içi LRU + TTL (cachetools.TTLCache)
+# 2. katman: 'analiz_onbellek' tablosu (yeniden başlatmalardan etkilenmez, worker'lar arası ortak);
+#            ONBELLEK_DB_TTL_SN'yi geçen satırlar periyodik temizlikte silinir
+# Anahtar: normalize edilmiş rüya metni + yorumcu tipi + premium + burç özeti (sha256)
+
+ONBELLEK_AKTIF = os.getenv("ONBELLEK_AKTIF", "1") == "1"
+ONBELLEK_BOYUT = int(os.getenv("ONBELLEK_BOYUT", "1024"))
+ONBELLEK_TTL_SN = int(os.getenv("ONBELLEK_TTL_SN", "3600"))
+ONBELLEK_DB_TTL_SN = int(os.getenv("ONBELLEK_DB_TTL_SN", str(7 * 24 * 3600)))
+# Önbellekten dönen cevap lifetime_usage_count'a sayılsın mı?
+ONBELLEK_KOTAYA_SAY = os.getenv("ONBELLEK_KOTAYA_SAY", "1") == "1"
+
+SAKLANAN_ALANLAR = ("yorum", "baslik", "duygu", "gorsel_prompt")
+
+_yerel = TTLCache(maxsize=ONBELLEK_BOYUT, ttl=ONBELLEK_TTL_SN)
+_arka_plan_gorevleri: set[asyncio.Task] = set()
+
+
+def metni_normalize_et(metin: str) -> str:
+    """Unicode NFKC, küçük harf ve tek boşluk: aynı rüyanın farklı yazımları aynı anahtarı versin."""
+    metin = unicodedata.normalize("NFKC", metin).casefold()
+    return " ".join(metin.split())
+
+
+def icerik_ozeti(ruya_metni: str) -> str:
+    """Rüya metninin içerik özeti (Ruya.icerik_ozeti): aynı rüyanın farklı yazımları aynı özeti verir."""
+    return hashlib.sha256(metni_normalize_et(ruya_metni).encode("utf-8")).hexdigest()
+
+
+def anahtar_olustur(ruya_metni: str, interpreter_type: str, is_premium: bool, zodiac: str) -> str:
+    parcalar = [metni_normalize_et(ruya_metni), interpreter_type, "premium" if is_premium else "free", zodiac]
+    return hashlib.sha256("\x1f".join(parcalar).encode("utf-8")).hexdigest()
+
+
+def _db_getir(db, anahtar: str) -> dict | None:
+    kayit = db.query(models.AnalizOnbellek).filter(models.AnalizOnbellek.anahtar == anahtar).first()
+    if not kayit:
+        return None
+    if kayit.olusturma and kayit.olusturma < datetime.utcnow() - timedelta(seconds=ONBELLEK_DB_TTL_SN):
+        return None
+    return json.loads(kayit.sonuc)
+
+
+def eski_kayitlari_temizle(db) -> int:
+    """TTL'i dolmuş (artık okunmayan) önbellek satırlarını siler; periyodik temizlikte çağrılır."""
+    sinir = datetime.utcnow() - timedelta(seconds=ONBELLEK_DB_TTL_SN)
+    silinen = db.query(models.AnalizOnbellek).filter(models.AnalizOnbellek.olusturma < sinir).delete(synchronize_session=False)
+    db.commit()
+    if silinen:
+        metrics.artir("onbellek_silinen", silinen)
+    return silinen
+
+
+def _db_yaz(db, anahtar: str, sonuc: dict) -> None:
+    db.add(models.AnalizOnbellek(anahtar=anahtar, sonuc=json.dumps(sonuc, ensure_ascii=False)))
+    try:
+        db.commit()
+    except IntegrityError:
+        # Başka bir worker aynı anahtarı az önce yazmış; eskisini tazeleyelim
+        db.rollback()
+        db.query(models.AnalizOnbellek).filter(models.AnalizOnbellek.anahtar == anahtar).update(
+            {"sonuc": json.dumps(sonuc, ensure_ascii=False), "olusturma": datetime.utcnow()}
+        )
+        db.commit()
+
+
+async def getir(anahtar: str) -> dict | None:
+    if not ONBELLEK_AKTIF:
+        return None
+
+    sonuc = _yerel.get(anahtar)
+    if sonuc is not None:
+        metrics.artir("onbellek_isabet.yerel")
+        return dict(sonuc)
+
+    try:
+        sonuc = await db_calistir(_db_getir, anahtar)
+    except Exception as e:
+        print(f"⚠️ Önbellek okuma hatası: {e}")
+        sonuc = None
+    if sonuc is not None:
+        metrics.artir("onbellek_isabet.db")
+        _yerel[anahtar] = sonuc
+        return dict(sonuc)
+
+    metrics.artir("onbellek_iska")
+    return None
+
+
+def yaz(anahtar: str, sonuc: dict) -> None:
+    """Yerel katmana hemen yazar; DB katmanını isteği bekletmeden arka planda günceller."""
+    if not ONBELLEK_AKTIF:
+        return
+
+    # gorsel_prompt tembel üretimde boş olabilir (görsel ilk istendiğinde üretilir)
+    saklanan = {alan: sonuc.get(alan) for alan in SAKLANAN_ALANLAR}
+    _yerel[anahtar] = saklanan
+
+    async def _arka_planda():
+        try:
+            await db_calistir(_db_yaz, anahtar, saklanan)
+        except Exception as e:
+            print(f"⚠️ Önbellek yazma hatası: {e}")
+
+    gorev = asyncio.create_task(_arka_planda())
+    _arka_plan_gorevleri.add(gorev)
+    gorev.add_done_callback(_arka_plan_gorevleri.discard)
@@ -0,0 +1,79 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+import metrics
+
+# --- Küçük aşama grafiği çalıştırıcı ---
+# Her aşama bağımlılıkları bitince başlar; birbirine bağımlı olmayan aşamalar
+# aynı anda çalışır. Her aşamanın kendi zaman aşımı, yeniden deneme ayarı ve
+# süre ölçümü vardır. Aşama sonuçları baglam[asama.ad] içine yazılır.
+# baglam["son_tarih"] (time.monotonic) verilirse hiçbir aşama onu aşamaz.
+
+
+@dataclass
+class Asama:
+    ad: str
+    fn: Callable[[dict], Awaitable[Any]]
+    bagimliliklar: tuple[str, ...] = ()
+    zaman_asimi: float | None = None  # saniye, None: sınırsız
+    deneme: int = 1                   # toplam deneme sayısı
+    bekleme: float = 0.5              # denemeler arası bekleme (her denemede 2 katına çıkar)
+    yeniden_denenebilir: tuple[type[BaseException], ...] = field(default=(Exception,))
+    denenmeyecek: tuple[type[BaseException], ...] = ()  # bu hatalarda hemen vazgeç
+
+
+def _zaman_asimi(asama: Asama, baglam: dict) -> float | None:
+    son_tarih = baglam.get("son_tarih")
+    if son_tarih is None:
+        return asama.zaman_asimi
+    kalan = max(0.0, son_tarih - time.monotonic())
+    return kalan if asama.zaman_asimi is None else min(asama.zaman_asimi, kalan)
+
+
+async def asama_calistir(asama: Asama, baglam: dict) -> Any:
+    for deneme_no in range(1, asama.deneme + 1):
+        baslangic = time.perf_counter()
+        try:
+            sonuc = await asyncio.wait_for(asama.fn(baglam), timeout=_zaman_asimi(asama, baglam))
+            metrics.gozlem(f"asama_suresi_ms.{asama.ad}", (time.perf_counter() - baslangic) * 1000)
+            return sonuc
+        except asama.yeniden_denenebilir as e:
+            metrics.artir(f"asama_hata.{asama.ad}")
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.artir(f"asama_zaman_asimi.{asama.ad}")
+            if deneme_no >= asama.deneme or isinstance(e, asama.denenmeyecek):
+                raise
+            if baglam.get("son_tarih") is not None and time.monotonic() >= baglam["son_tarih"]:
+                raise
+            print(f"🔁 Aşama '{asama.ad}' tekrar deneniyor ({deneme_no}/{asama.deneme}): {e!r}")
+            metrics.artir(f"asama_yeniden_deneme.{asama.ad}")
+            await asyncio.sleep(asama.bekleme * (2 ** (deneme_no - 1)))
+
+
+async def graf_calistir(asamalar: list[Asama], baglam: dict) -> dict:
+    """Aşamaları bağımlılık sırasına göre, bağımsız olanları eşzamanlı çalıştırır.
+
+    Listede olmayan bağımlılıkların baglam içinde zaten hazır olduğu varsayılır.
+    Bir aşama hata verirse kalan aşamalar iptal edilir ve hata yukarı fırlatılır.
+    """
+    gorevler: dict[str, asyncio.Task] = {}
+
+    async def _calistir(asama: Asama):
+        for bagimlilik in asama.bagimliliklar:
+            if bagimlilik in gorevler:
+                await gorevler[bagimlilik]
+        baglam[asama.ad] = await asama_calistir(asama, baglam)
+
+    for asama in asamalar:
+        gorevler[asama.ad] = asyncio.create_task(_calistir(asama))
+
+    try:
+        await asyncio.gather(*gorevler.values())
+    except BaseException:
+        for gorev in gorevler.values():
+            gorev.cancel()
+        await asyncio.gather(*gorevler.values(), return_exceptions=True)
+        raise
+    return baglam
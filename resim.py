@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import asyncio
+import hmac
+import hashlib
+import secrets
+import tempfile
+import urllib.parse
+from dataclasses import dataclass
+
+import httpx
+
+import metrics
+
+# --- RÜYA GÖRSELİ PROXY + DİSK ÖNBELLEĞİ ---
+# /resim/{ruya_id} görseli kaynaktan (pollinations) bir kez indirir, içerik
+# adresli olarak diske yazar ve sonraki her görüntülemede diskten verir.
+# Seed rüya id'sinden türetilir: aynı rüya her zaman aynı görseli (aynı URL'i) alır.
+#
+# Disk düzeni (RESIM_DIZINI altında):
+#   icerik/ab/<sha256(bayt)>       görsel baytları (ETag = bu özet)
+#   anahtar/cd/<sha256(kaynak)>    {"icerik": ..., "tur": ...} kaynak URL -> içerik eşlemesi
+# Dosyalar geçici dosyaya yazılıp yerine taşınır; worker'lar aynı anda yazsa da yarım dosya görülmez.
+# Boyut RESIM_DISK_EN_COK_MB ile sınırlı: periyodik temizlik (disk_temizle) en uzun
+# süredir görüntülenmeyen anahtarları (mtime, diskten verilince tazelenir) siler,
+# hiçbir anahtarın göstermediği içerik dosyası da onunla gider.
+#
+# Kaynak değiştirilebilir: RESIM_KAYNAK_URL yerel bir sahte görsel sunucusunu
+# gösterebilir ya da `getirici` (async url -> (bayt, içerik türü)) başka bir fonksiyonla değiştirilebilir.
+
+RESIM_DIZINI = os.getenv("RESIM_DIZINI", "./resim_onbellek")
+RESIM_KAYNAK_URL = os.getenv("RESIM_KAYNAK_URL", "https://image.pollinations.ai").rstrip("/")
+RESIM_GENISLIK = int(os.getenv("RESIM_GENISLIK", "768"))
+RESIM_YUKSEKLIK = int(os.getenv("RESIM_YUKSEKLIK", "1024"))
+RESIM_ZAMAN_ASIMI_SN = float(os.getenv("RESIM_ZAMAN_ASIMI_SN", "60"))
+RESIM_MAX_AGE_SN = int(os.getenv("RESIM_MAX_AGE_SN", str(30 * 24 * 3600)))
+RESIM_DISK_EN_COK_MB = int(os.getenv("RESIM_DISK_EN_COK_MB", "2048"))
+# Diskten verilen görselin anahtar mtime'ı en çok bu sıklıkla tazelenir (her isabette yazmamak için)
+_DOKUNMA_ARALIGI_SN = 3600
+# Yazımı süren (ya da yarıda kalmış) dosyalara temizlik bu yaştan önce dokunmaz
+_YAZIM_PAYI_SN = 3600
+# İstemciye dönen resim_url: "1" ise mutlak /resim/{id} adresi, "0" ise doğrudan kaynak URL.
+# Taban: GENEL_TABAN_URL, boşsa isteğin geldiği adres (request.base_url). Proxy arkasında
+# şema/host doğru gelsin diye uvicorn --proxy-headers --forwarded-allow-ips ile çalıştırılmalı.
+RESIM_PROXY = os.getenv("RESIM_PROXY", "1") == "1"
+GENEL_TABAN_URL = os.getenv("GENEL_TABAN_URL", "").rstrip("/")
+# /resim/{id} adresleri imzalıdır (?imza=): prompt'u henüz olmayan rüya için tembel
+# LLM üretimi yalnızca sunucunun verdiği imzalı adresle tetiklenir. Anahtar tüm
+# worker'larda aynı olmalı: RESIM_IMZA_ANAHTARI, boşsa GEMINI_API_KEY'den türetilir.
+_imza_kaynagi = os.getenv("RESIM_IMZA_ANAHTARI") or os.getenv("GEMINI_API_KEY")
+if not _imza_kaynagi:
+    print("⚠️ RESIM_IMZA_ANAHTARI yok: görsel imzaları yalnızca bu süreçte geçerli")
+    _imza_kaynagi = secrets.token_hex(32)
+_IMZA_ANAHTARI = hashlib.sha256(f"ruya-resim-imza:{_imza_kaynagi}".encode("utf-8")).digest()
+
+
+class ResimHatasi(Exception):
+    """Kaynaktan görsel alınamadı (502 olarak döner)."""
+
+
+@dataclass
+class ResimDosyasi:
+    yol: str
+    etag: str
+    tur: str
+
+
+def tohum(ruya_id: int) -> int:
+    return int(hashlib.sha256(f"ruya-{ruya_id}".encode("utf-8")).hexdigest()[:8], 16) % (2 ** 31)
+
+
+def kaynak_url_olustur(gorsel_prompt: str, seed: int) -> str:
+    encoded_prompt = urllib.parse.quote(gorsel_prompt)
+    return f"{RESIM_KAYNAK_URL}/prompt/{encoded_prompt}?width={RESIM_GENISLIK}&height={RESIM_YUKSEKLIK}&seed={seed}&nologo=true"
+
+
+def imza(ruya_id: int) -> str:
+    return hmac.new(_IMZA_ANAHTARI, f"resim-{ruya_id}".encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+
+def imza_gecerli(ruya_id: int, gelen: str | None) -> bool:
+    return bool(gelen) and hmac.compare_digest(imza(ruya_id), gelen)
+
+
+def istemci_url(ruya_id: int, kaynak_url: str | None, taban_url: str = "") -> str:
+    """İstemcinin doğrudan yükleyebileceği mutlak, imzalı görsel adresi.
+
+    Görsel prompt'u henüz üretilmediyse (tembel üretim) kaynak URL yoktur; proxy üretir.
+    Taban bilinmiyorsa (GENEL_TABAN_URL da boş) göreli adres yerine kaynak URL döner.
+    """
+    taban = GENEL_TABAN_URL or taban_url.rstrip("/")
+    if kaynak_url and (not RESIM_PROXY or not taban):
+        return kaynak_url
+    return f"{taban}/resim/{ruya_id}?imza={imza(ruya_id)}"
+
+
+_istemci: httpx.AsyncClient | None = None
+
+
+async def http_getir(url: str) -> tuple[bytes, str]:
+    global _istemci
+    if _istemci is None:
+        _istemci = httpx.AsyncClient(timeout=RESIM_ZAMAN_ASIMI_SN, follow_redirects=True)
+    try:
+        cevap = await _istemci.get(url)
+        cevap.raise_for_status()
+    except httpx.HTTPError as e:
+        raise ResimHatasi(f"Görsel alınamadı: {e!r}") from e
+    tur = cevap.headers.get("content-type", "").split(";")[0].strip()
+    if not tur.startswith("image/"):
+        raise ResimHatasi(f"Beklenmeyen içerik türü: {tur or '-'}")
+    return cevap.content, tur
+
+
+getirici = http_getir
+
+
+def _yol(tur: str, ozet: str) -> str:
+    return os.path.join(RESIM_DIZINI, tur, ozet[:2], ozet)
+
+
+def _atomik_yaz(yol: str, veri: bytes) -> None:
+    os.makedirs(os.path.dirname(yol), exist_ok=True)
+    fd, gecici = tempfile.mkstemp(dir=os.path.dirname(yol), prefix=".yaziliyor-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(veri)
+        os.replace(gecici, yol)
+    except BaseException:
+        if os.path.exists(gecici):
+            os.remove(gecici)
+        raise
+
+
+def _diskten_oku(anahtar: str) -> ResimDosyasi | None:
+    anahtar_yolu = _yol("anahtar", anahtar)
+    try:
+        with open(anahtar_yolu, encoding="utf-8") as f:
+            kayit = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    yol = _yol("icerik", kayit["icerik"])
+    if not os.path.exists(yol):
+        return None
+    try:
+        if time.time() - os.stat(anahtar_yolu).st_mtime > _DOKUNMA_ARALIGI_SN:
+            os.utime(anahtar_yolu)
+    except FileNotFoundError:
+        pass
+    return ResimDosyasi(yol=yol, etag=f'"{kayit["icerik"]}"', tur=kayit["tur"])
+
+
+def _diske_yaz(anahtar: str, veri: bytes, tur: str) -> ResimDosyasi:
+    icerik = hashlib.sha256(veri).hexdigest()
+    yol = _yol("icerik", icerik)
+    if not os.path.exists(yol):
+        _atomik_yaz(yol, veri)
+    _atomik_yaz(_yol("anahtar", anahtar), json.dumps({"icerik": icerik, "tur": tur}).encode("utf-8"))
+    return ResimDosyasi(yol=yol, etag=f'"{icerik}"', tur=tur)
+
+
+def _dosyalar(tur: str):
+    for dizin, _, adlar in os.walk(os.path.join(RESIM_DIZINI, tur)):
+        for ad in adlar:
+            yol = os.path.join(dizin, ad)
+            try:
+                yield ad, yol, os.stat(yol)
+            except FileNotFoundError:
+                continue
+
+
+def _sil(yol: str) -> int:
+    try:
+        os.remove(yol)
+        return 1
+    except FileNotFoundError:
+        return 0
+
+
+def disk_temizle() -> int:
+    """Disk önbelleğini RESIM_DISK_EN_COK_MB altına indirir; silinen dosya sayısını döner (thread'de çalışır)."""
+    eski = time.time() - _YAZIM_PAYI_SN
+    silinen = 0
+    icerikler = {}  # özet -> (yol, boyut, mtime)
+    for ad, yol, bilgi in _dosyalar("icerik"):
+        if ad.startswith(".yaziliyor-"):
+            silinen += _sil(yol) if bilgi.st_mtime < eski else 0
+        else:
+            icerikler[ad] = (yol, bilgi.st_size, bilgi.st_mtime)
+
+    anahtarlar = []  # (mtime, yol, özet)
+    for ad, yol, bilgi in _dosyalar("anahtar"):
+        try:
+            with open(yol, encoding="utf-8") as f:
+                icerik = json.load(f)["icerik"]
+        except FileNotFoundError:
+            continue
+        except (ValueError, KeyError, TypeError):
+            icerik = None
+        if ad.startswith(".yaziliyor-") or icerik not in icerikler:
+            # Bozuk/yarım ya da içeriği silinmiş anahtar (yazılmakta olanı atla)
+            silinen += _sil(yol) if bilgi.st_mtime < eski else 0
+            continue
+        anahtarlar.append((bilgi.st_mtime, yol, icerik))
+
+    kullanan: dict[str, int] = {}
+    for _, _, icerik in anahtarlar:
+        kullanan[icerik] = kullanan.get(icerik, 0) + 1
+    for icerik, (yol, _, mtime) in list(icerikler.items()):
+        # Anahtarı olmayan içerik (anahtarı yazılmakta olabilecek yenileri hariç)
+        if icerik not in kullanan and mtime < eski:
+            silinen += _sil(yol)
+            del icerikler[icerik]
+
+    toplam = sum(boyut for _, boyut, _ in icerikler.values())
+    sinir = RESIM_DISK_EN_COK_MB * 1024 * 1024
+    anahtarlar.sort()
+    for _, yol, icerik in anahtarlar:
+        if toplam <= sinir:
+            break
+        silinen += _sil(yol)
+        kullanan[icerik] -= 1
+        if kullanan[icerik] == 0 and icerik in icerikler:
+            icerik_yolu, boyut, _ = icerikler.pop(icerik)
+            silinen += _sil(icerik_yolu)
+            toplam -= boyut
+
+    metrics.ayarla("resim_disk_bayt", toplam)
+    if silinen:
+        metrics.artir("resim_disk_silinen", silinen)
+    return silinen
+
+
+_ucustakiler: dict[str, asyncio.Task] = {}
+
+
+async def _indir(anahtar: str, kaynak_url: str) -> ResimDosyasi:
+    with metrics.sure_olc("resim_indirme_ms"):
+        veri, tur = await getirici(kaynak_url)
+    metrics.artir("resim_indirilen_bayt", len(veri))
+    return await asyncio.to_thread(_diske_yaz, anahtar, veri, tur)
+
+
+async def getir(kaynak_url: str) -> ResimDosyasi:
+    """Görseli diskten verir; yoksa bir kez indirir (aynı anda gelen ilk görüntülemeler tek indirmede birleşir)."""
+    anahtar = hashlib.sha256(kaynak_url.encode("utf-8")).hexdigest()
+    dosya = await asyncio.to_thread(_diskten_oku, anahtar)
+    if dosya:
+        metrics.artir("resim_isabet")
+        return dosya
+
+    metrics.artir("resim_iska")
+    return await tek_sefer(anahtar, lambda: _indir(anahtar, kaynak_url))
+
+
+async def tek_sefer(anahtar: str, fn):
+    """fn() aynı anahtar için aynı anda tek kez çalışır, bekleyenler aynı sonucu alır.
+
+    İş ayrı bir görevde yürür: ilk isteyen bağlantıyı kapatsa da diğer bekleyenler için sürer.
+    """
+    gorev = _ucustakiler.get(anahtar)
+    if gorev is None:
+        gorev = asyncio.create_task(fn())
+        _ucustakiler[anahtar] = gorev
+        gorev.add_done_callback(lambda g: _bitti(anahtar, g))
+    else:
+        metrics.artir("resim_birlesen")
+    return await asyncio.shield(gorev)
+
+
+def _bitti(anahtar: str, gorev: asyncio.Task) -> None:
+    _ucustakiler.pop(anahtar, None)
+    if not gorev.cancelled():
+        gorev.exception()  # bekleyen kalmadıysa "exception was never retrieved" uyarısı çıkmasın
+
+
+async def kapat() -> None:
+    global _istemci
+    if _istemci is not None:
+        await _istemci.aclose()
+        _istemci = None
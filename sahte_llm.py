@@ -0,0 +1,196 @@
+import os
+import json
+import math
+import random
+import asyncio
+import hashlib
+from types import SimpleNamespace
+
+from promptlar import EK_BILGI_PROMPT, GORSEL_PROMPT_ISTEGI
+
+# --- SAHTE LLM SAĞLAYICISI (LLM_SAGLAYICI=sahte) ---
+# /analiz-et'i ağ ve API anahtarı olmadan, gerçekçi upstream gecikmesiyle
+# dizüstünde/CI'da yük altında denemek için süreç içi taklit.
+# Metin, prompt'un özetinden deterministik üretilir (aynı istek -> aynı cevap);
+# gecikme, hata ve kuyruk olayları SAHTE_TOHUM ile tohumlanmış tek bir RNG'den çekilir.
+#
+# Gecikme = ilk token süresi (dağılımdan) + çıktı token sayısı * SAHTE_TOKEN_MS
+#   sabit:     SAHTE_GECIKME_MS
+#   uniform:   SAHTE_GECIKME_MS * (1 ± SAHTE_GECIKME_SAPMA)
+#   lognormal: medyanı SAHTE_GECIKME_MS, sigması SAHTE_GECIKME_SAPMA
+# SAHTE_KUYRUK_ORANI olasılıkla ilk token süresi SAHTE_KUYRUK_CARPANI ile çarpılır (yavaş kuyruk).
+# SAHTE_HATA_ORANI olasılıkla çağrı ilk token süresi kadar bekleyip hata verir,
+# SAHTE_ASILMA_ORANI olasılıkla SAHTE_ASILMA_SN boyunca cevap vermez (zaman aşımlarını denemek için).
+
+SAHTE_GECIKME_DAGILIMI = os.getenv("SAHTE_GECIKME_DAGILIMI", "lognormal")
+SAHTE_GECIKME_MS = float(os.getenv("SAHTE_GECIKME_MS", "600"))
+SAHTE_GECIKME_SAPMA = float(os.getenv("SAHTE_GECIKME_SAPMA", "0.4"))
+SAHTE_TOKEN_MS = float(os.getenv("SAHTE_TOKEN_MS", "4"))
+SAHTE_KUYRUK_ORANI = float(os.getenv("SAHTE_KUYRUK_ORANI", "0.02"))
+SAHTE_KUYRUK_CARPANI = float(os.getenv("SAHTE_KUYRUK_CARPANI", "5"))
+SAHTE_HATA_ORANI = float(os.getenv("SAHTE_HATA_ORANI", "0"))
+SAHTE_ASILMA_ORANI = float(os.getenv("SAHTE_ASILMA_ORANI", "0"))
+SAHTE_ASILMA_SN = float(os.getenv("SAHTE_ASILMA_SN", "300"))
+# Yorum cevabı, max_output_tokens'ın bu oranı kadar (±%20) token üretir
+SAHTE_CIKTI_ORANI = float(os.getenv("SAHTE_CIKTI_ORANI", "0.6"))
+SAHTE_GORSEL_TOKEN = int(os.getenv("SAHTE_GORSEL_TOKEN", "60"))
+SAHTE_AKIS_PARCA_TOKEN = int(os.getenv("SAHTE_AKIS_PARCA_TOKEN", "20"))
+SAHTE_TOHUM = os.getenv("SAHTE_TOHUM", "42")
+
+GECIKME_DAGILIMLARI = ("sabit", "uniform", "lognormal")
+
+# Kaba token tahmini: ~4 karakter / token, kelime başına ~1.3 token
+KARAKTER_BASINA_TOKEN = 0.25
+KELIME_BASINA_TOKEN = 1.3
+
+_KELIMELER = (
+    "rüya", "gölge", "ışık", "kapı", "deniz", "yol", "ayna", "sessizlik", "yıldız", "rüzgar",
+    "ağaç", "kuyu", "köprü", "ateş", "su", "dağ", "anahtar", "kuş", "gece", "şafak",
+    "bilinçaltı", "işaret", "yolculuk", "değişim", "korku", "umut", "hatıra", "sır", "arayış", "huzur",
+)
+_DUYGULAR = ("Merak", "Huzur", "Kaygı", "Umut", "Özlem", "Korku", "Şaşkınlık")
+
+
+class SahteHata(Exception):
+    """Sahte upstream hatası (SAHTE_HATA_ORANI)."""
+
+
+def _metin(icerik) -> str:
+    if isinstance(icerik, str):
+        return icerik
+    if isinstance(icerik, dict):
+        return " ".join(_metin(p) for p in icerik.get("parts", ()))
+    if isinstance(icerik, (list, tuple)):
+        return " ".join(_metin(p) for p in icerik)
+    return str(icerik)
+
+
+def _token_tahmini(metin: str) -> int:
+    return max(1, int(len(metin) * KARAKTER_BASINA_TOKEN))
+
+
+class SahteCevap:
+    """GenerateContentResponse taklidi: .text, .usage_metadata; stream ise async parça akışı."""
+
+    def __init__(self, parcalar: list[str], girdi_token: int, cikti_token: int, parca_bekleme: float = 0.0):
+        self._parcalar = parcalar
+        self._parca_bekleme = parca_bekleme
+        self.text = "".join(parcalar)
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=girdi_token,
+            candidates_token_count=cikti_token,
+            total_token_count=girdi_token + cikti_token,
+        )
+
+    async def __aiter__(self):
+        for i, parca in enumerate(self._parcalar):
+            if i:
+                await asyncio.sleep(self._parca_bekleme)
+            yield SimpleNamespace(text=parca)
+
+
+class SahteSohbet:
+    def __init__(self, model: "SahteModel", history):
+        self.model = model
+        self.history = list(history or [])
+
+    async def send_message_async(self, icerik, generation_config=None, stream=False):
+        girdi = self.model.sistem_talimati + " " + " ".join(_metin(m) for m in self.history) + " " + _metin(icerik)
+        cevap = await self.model._uret(_metin(icerik), girdi, generation_config, stream)
+        self.history += [
+            {"role": "user", "parts": [_metin(icerik)]},
+            {"role": "model", "parts": [cevap.text]},
+        ]
+        return cevap
+
+
+class SahteModel:
+    def __init__(self, saglayici: "SahteSaglayici", model_name: str, sistem_talimati: str, ayar: dict):
+        self.saglayici = saglayici
+        self.model_name = model_name
+        self.sistem_talimati = sistem_talimati
+        self.ayar = dict(ayar)
+
+    def start_chat(self, history=None) -> SahteSohbet:
+        return SahteSohbet(self, history)
+
+    async def generate_content_async(self, icerik, generation_config=None, stream=False):
+        return await self._uret(_metin(icerik), self.sistem_talimati + " " + _metin(icerik), generation_config, stream)
+
+    async def _uret(self, mesaj: str, girdi: str, generation_config, stream: bool) -> SahteCevap:
+        ayar = {**self.ayar, **(generation_config or {})}
+        max_token = ayar.get("max_output_tokens") or 2048
+        rng = random.Random(hashlib.sha256(girdi.encode("utf-8")).digest())
+
+        if ayar.get("response_mime_type") == "application/json":
+            metin = json.dumps({
+                "yorum": _cumle(rng, _yorum_tokeni(rng, max_token)),
+                "baslik": _baslik(rng),
+                "duygu": rng.choice(_DUYGULAR),
+                "gorsel_prompt": _cumle(rng, SAHTE_GORSEL_TOKEN),
+            }, ensure_ascii=False)
+        elif mesaj == EK_BILGI_PROMPT:
+            metin = f"{_baslik(rng)} | {rng.choice(_DUYGULAR)}"
+        elif mesaj == GORSEL_PROMPT_ISTEGI:
+            metin = _cumle(rng, min(max_token, SAHTE_GORSEL_TOKEN))
+        else:
+            metin = _cumle(rng, _yorum_tokeni(rng, max_token))
+
+        kelimeler = metin.split(" ")
+        cikti_token = min(max_token, math.ceil(len(kelimeler) * KELIME_BASINA_TOKEN))
+        await self.saglayici.bekle_veya_hata()
+
+        token_bekleme = SAHTE_TOKEN_MS / 1000
+        if not stream:
+            await asyncio.sleep(cikti_token * token_bekleme)
+            return SahteCevap([metin], _token_tahmini(girdi), cikti_token)
+
+        parca_kelime = max(1, int(SAHTE_AKIS_PARCA_TOKEN / KELIME_BASINA_TOKEN))
+        parcalar = [
+            " ".join(kelimeler[i:i + parca_kelime]) + (" " if i + parca_kelime < len(kelimeler) else "")
+            for i in range(0, len(kelimeler), parca_kelime)
+        ]
+        return SahteCevap(parcalar, _token_tahmini(girdi), cikti_token, SAHTE_AKIS_PARCA_TOKEN * token_bekleme)
+
+
+def _yorum_tokeni(rng: random.Random, max_token: int) -> int:
+    return max(1, min(max_token, int(max_token * SAHTE_CIKTI_ORANI * rng.uniform(0.8, 1.2))))
+
+
+def _cumle(rng: random.Random, token: int) -> str:
+    return " ".join(rng.choice(_KELIMELER) for _ in range(max(1, int(token / KELIME_BASINA_TOKEN))))
+
+
+def _baslik(rng: random.Random) -> str:
+    return " ".join(rng.choice(_KELIMELER).capitalize() for _ in range(rng.randint(3, 5)))
+
+
+class SahteSaglayici:
+    def __init__(self):
+        if SAHTE_GECIKME_DAGILIMI not in GECIKME_DAGILIMLARI:
+            raise ValueError(f"Geçersiz SAHTE_GECIKME_DAGILIMI: {SAHTE_GECIKME_DAGILIMI}")
+        self._rng = random.Random(SAHTE_TOHUM or None)
+
+    def model_kur(self, model_adi: str, ad: str, sistem_talimati: str, ayar: dict) -> SahteModel:
+        return SahteModel(self, f"sahte/{model_adi}", sistem_talimati, ayar)
+
+    def ilk_token_ms(self) -> float:
+        if SAHTE_GECIKME_DAGILIMI == "sabit":
+            ms = SAHTE_GECIKME_MS
+        elif SAHTE_GECIKME_DAGILIMI == "uniform":
+            ms = self._rng.uniform(SAHTE_GECIKME_MS * (1 - SAHTE_GECIKME_SAPMA), SAHTE_GECIKME_MS * (1 + SAHTE_GECIKME_SAPMA))
+        else:
+            ms = SAHTE_GECIKME_MS * math.exp(self._rng.gauss(0, SAHTE_GECIKME_SAPMA))
+        if self._rng.random() < SAHTE_KUYRUK_ORANI:
+            ms *= SAHTE_KUYRUK_CARPANI
+        return max(0.0, ms)
+
+    async def bekle_veya_hata(self) -> None:
+        """İlk token süresi kadar bekler; ayarlanan oranlarda hata verir ya da asılı kalır."""
+        ms = self.ilk_token_ms()
+        zar = self._rng.random()
+        if zar < SAHTE_ASILMA_ORANI:
+            await asyncio.sleep(SAHTE_ASILMA_SN)
+        await asyncio.sleep(ms / 1000)
+        if zar >= 1 - SAHTE_HATA_ORANI:
+            raise SahteHata("503 Sahte upstream hatası")
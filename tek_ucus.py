@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+import models
+import metrics
+from database import db_calistir
+
+# --- TEK UÇUŞ (single-flight) ---
+# Aynı kullanıcının aynı rüyası için eşzamanlı gelen istekler tek bir analizde
+# birleştirilir; bekleyenlerin hepsi aynı sonucu (aynı rüya id'si) alır.
+# Worker içi: anahtar -> asyncio.Future
+# Worker'lar arası: 'analiz_kiralari' tablosunda süreli kira (lease). Kirayı alan
+# analizi çalıştırır ve sonucu satıra yazar; diğerleri satırı yoklar.
+# calistir() tek sonuç dönen işler içindir; parça parça cevap veren SSE akışı
+# lider_ol() / Ucus ile aynı uçuşa katılır.
+
+TEK_UCUS_DB = os.getenv("TEK_UCUS_DB", "1") == "1"
+TEK_UCUS_KIRA_SN = float(os.getenv("TEK_UCUS_KIRA_SN", "120"))
+TEK_UCUS_SONUC_SN = float(os.getenv("TEK_UCUS_SONUC_SN", "30"))
+TEK_UCUS_YOKLAMA_SN = float(os.getenv("TEK_UCUS_YOKLAMA_SN", "0.5"))
+
+_ucustakiler: dict[str, asyncio.Future] = {}
+# Lider hatasız yarıda kaldı (istemci bağlantıyı kapattı): bekleyenler işi kendileri dener
+_LIDER_DUSTU = object()
+
+
+def anahtar_olustur(user_id: str, ruya_anahtari: str) -> str:
+    return hashlib.sha256(f"{user_id}\x1f{ruya_anahtari}".encode("utf-8")).hexdigest()
+
+
+def _kira_al(db, anahtar: str, sahip: str):
+    """'alindi' (kira bizde), dict (biten analizin sonucu) veya None (başkası çalışıyor) döner."""
+    simdi = datetime.utcnow()
+    kira = db.query(models.AnalizKirasi).filter(models.AnalizKirasi.anahtar == anahtar).first()
+
+    if not kira:
+        db.add(models.AnalizKirasi(anahtar=anahtar, sahip=sahip, bitis=simdi + timedelta(seconds=TEK_UCUS_KIRA_SN)))
+        try:
+            db.commit()
+            return "alindi"
+        except IntegrityError:
+            db.rollback()
+            return None
+
+    if kira.bitis > simdi:
+        return json.loads(kira.sonuc) if kira.sonuc else None
+
+    # Süresi dolmuş kira (sahibi çökmüş) ya da bayatlamış sonuç: koşullu UPDATE ile devral
+    devralindi = db.query(models.AnalizKirasi).filter(
+        models.AnalizKirasi.id == kira.id,
+        models.AnalizKirasi.sahip == kira.sahip,
+        models.AnalizKirasi.bitis == kira.bitis,
+    ).update(
+        {"sahip": sahip, "bitis": simdi + timedelta(seconds=TEK_UCUS_KIRA_SN), "sonuc": None},
+        synchronize_session=False,
+    )
+    db.commit()
+    return "alindi" if devralindi == 1 else None
+
+
+def _kira_bitir(db, anahtar: str, sahip: str, sonuc: dict) -> None:
+    db.query(models.AnalizKirasi).filter(
+        models.AnalizKirasi.anahtar == anahtar,
+        models.AnalizKirasi.sahip == sahip,
+    ).update(
+        {"sonuc": json.dumps(sonuc, ensure_ascii=False), "bitis": datetime.utcnow() + timedelta(seconds=TEK_UCUS_SONUC_SN)},
+        synchronize_session=False,
+    )
+    db.commit()
+
+
+def _kira_birak(db, anahtar: str, sahip: str) -> None:
+    db.query(models.AnalizKirasi).filter(
+        models.AnalizKirasi.anahtar == anahtar,
+        models.AnalizKirasi.sahip == sahip,
+    ).delete(synchronize_session=False)
+    db.commit()
+
+
+def eski_kiralari_temizle(db) -> int:
+    sinir = datetime.utcnow() - timedelta(hours=1)
+    silinen = db.query(models.AnalizKirasi).filter(models.AnalizKirasi.bitis < sinir).delete(synchronize_session=False)
+    db.commit()
+    return silinen
+
+
+async def _kira_bekle(anahtar: str, sahip: str):
+    """'alindi', biten analizin sonucu (dict) ya da None (kira sahibinden haber yok, kirasız çalışılır)."""
+    son_tarih = time.monotonic() + TEK_UCUS_KIRA_SN
+    while True:
+        durum = await db_calistir(_kira_al, anahtar, sahip)
+        if durum == "alindi" or isinstance(durum, dict):
+            return durum
+        if time.monotonic() > son_tarih:
+            metrics.artir("tek_ucus_bekleme_asimi")
+            return None
+        await asyncio.sleep(TEK_UCUS_YOKLAMA_SN)
+
+
+class Ucus:
+    """lider_ol()'un liderlik kaydı: iş bitince bitir(), bitmezse birak() çağrılmalı."""
+
+    def __init__(self, anahtar: str, gelecek: asyncio.Future, sahip: str | None):
+        self.anahtar = anahtar
+        self.gelecek = gelecek
+        self.sahip = sahip  # DB kirası bizdeyse sahip id'si
+
+    def _cik(self) -> None:
+        if _ucustakiler.get(self.anahtar) is self.gelecek:
+            del _ucustakiler[self.anahtar]
+
+    async def bitir(self, sonuc: dict) -> None:
+        self._cik()
+        if not self.gelecek.done():
+            self.gelecek.set_result(sonuc)
+        if self.sahip:
+            await asyncio.shield(db_calistir(_kira_bitir, self.anahtar, self.sahip, sonuc))
+
+    async def birak(self, hata: BaseException | None = None) -> None:
+        """Hata (Exception) bekleyenlere aynen iletilir; iptalde bekleyenler işi kendileri yapar.
+
+        Paylaşılan gelecek hiçbir zaman iptal edilmez: bekleyenler CancelledError almasın.
+        """
+        self._cik()
+        if not self.gelecek.done():
+            if isinstance(hata, Exception):
+                self.gelecek.set_exception(hata)
+                self.gelecek.exception()  # bekleyen yoksa "exception was never retrieved" uyarısı çıkmasın
+            else:
+                self.gelecek.set_result(_LIDER_DUSTU)
+        if self.sahip:
+            await asyncio.shield(db_calistir(_kira_birak, self.anahtar, self.sahip))
+
+
+async def lider_ol(anahtar: str) -> tuple[dict | None, Ucus | None]:
+    """(sonuç, None): aynı anahtarın uçuştaki / az önce biten analizinin sonucu.
+    (None, Ucus): analizi bu çağıran yapar; bekleyenler Ucus.bitir() ile sonucu alır.
+    Liderin hatası bekleyenlere aynen yükselir.
+    """
+    while True:
+        bekleyen = _ucustakiler.get(anahtar)
+        if bekleyen is not None:
+            sonuc = await asyncio.shield(bekleyen)
+            if sonuc is _LIDER_DUSTU:
+                continue
+            metrics.artir("tek_ucus_birlesen.yerel")
+            return sonuc, None
+
+        gelecek = asyncio.get_running_loop().create_future()
+        _ucustakiler[anahtar] = gelecek
+        ucus = Ucus(anahtar, gelecek, None)
+        if not TEK_UCUS_DB:
+            return None, ucus
+        try:
+            sahip = uuid.uuid4().hex
+            durum = await _kira_bekle(anahtar, sahip)
+        except BaseException as e:
+            await ucus.birak(e)
+            raise
+        if isinstance(durum, dict):
+            # Başka worker'ın sonucu: bu worker'da bekleyenler de alsın
+            metrics.artir("tek_ucus_birlesen.db")
+            ucus._cik()
+            gelecek.set_result(durum)
+            return durum, None
+        ucus.sahip = sahip if durum == "alindi" else None
+        return None, ucus
+
+
+async def calistir(anahtar: str, fn):
+    """fn() (async, JSON'a çevrilebilir sonuç döner) aynı anahtar için tek sefer çalışır."""
+    sonuc, ucus = await lider_ol(anahtar)
+    if ucus is None:
+        return sonuc
+    try:
+        sonuc = await fn()
+    except BaseException as e:
+        await ucus.birak(e)
+        raise
+    await ucus.bitir(sonuc)
+    return sonuc
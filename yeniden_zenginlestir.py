@@ -0,0 +1,210 @@
+"""Kayıtlı rüyaların başlık/duygu alanlarını toplu olarak yeniden üretir.
+
+Eski kayıtların başlık ve duyguları kırılgan "Başlık | Duygu" ayrıştırmasından
+gelir; çoğunda varsayılan "Bilinçaltı Mesajı" / "Nötr" kalmıştır. Bu iş, boş ya
+da varsayılan değerli satırları id sırasıyla parti parti okur (tablo belleğe
+alınmaz), her partiyi sınırlı eşzamanlılık ve hız sınırıyla modelden geçirir,
+sonuçları tek bir toplu UPDATE ile yazar ve son işlenen id'yi kontrol noktası
+dosyasına kaydeder. Yarıda kalırsa aynı komut kaldığı yerden devam eder.
+
+Her parti "id > son_id ORDER BY id LIMIT parti" ile ayrı, kısa bir sorguda
+okunur (bellekte en fazla bir parti): tüm iş boyunca tek bir imleç açık kalsaydı saatlerce
+süren bir okuma işlemi (Postgres'te eski snapshot) tutulur, SQLite'ta ise
+UPDATE'ler kilide takılırdı.
+
+Model, başlık/duygu rotasının (free) modelidir ama persona/üyelik talimatı
+yerine tarafsız bir etiketleme talimatıyla kurulur (free tanıtım CTA'sı yok).
+
+Örnekler:
+    python yeniden_zenginlestir.py
+    python yeniden_zenginlestir.py --parti 1000 --eszamanlilik 16 --hiz 10
+    python yeniden_zenginlestir.py --kuru --limit 50
+    python yeniden_zenginlestir.py --bastan
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime
+
+import google.generativeai as genai
+from sqlalchemy import or_, select, update
+
+import llm
+import models
+import kullanim
+import migrasyon
+from analiz import VARSAYILAN_BASLIK, VARSAYILAN_DUYGU
+from database import engine, db_calistir
+from pipeline import Asama, asama_calistir
+from promptlar import BASLIK_DUYGU_SEMASI, VARSAYILAN_YORUMCU, YENIDEN_ZENGINLESTIRME_SISTEM_TALIMATI, yeniden_zenginlestirme_prompt
+
+api_key = os.getenv("GEMINI_API_KEY")
+if api_key:
+    genai.configure(api_key=api_key)
+
+ASAMA_ADI = "yeniden_zenginlestir"
+VARSAYILAN_KONTROL_NOKTASI = "yeniden_zenginlestir.checkpoint.json"
+
+
+class HizSiniri:
+    """Saniyede en fazla 'hiz' çağrı: her çağrı bir sonraki boş zaman dilimini bekler."""
+
+    def __init__(self, hiz: float):
+        self.aralik = 1 / hiz if hiz > 0 else 0.0
+        self._sonraki = 0.0
+        self._kilit = asyncio.Lock()
+
+    async def bekle(self) -> None:
+        if not self.aralik:
+            return
+        async with self._kilit:
+            simdi = time.monotonic()
+            bekleme = self._sonraki - simdi
+            self._sonraki = max(simdi, self._sonraki) + self.aralik
+        if bekleme > 0:
+            await asyncio.sleep(bekleme)
+
+
+def kontrol_noktasi_oku(yol: str) -> dict:
+    if not os.path.exists(yol):
+        return {"son_id": 0, "islenen": 0, "guncellenen": 0, "basarisiz": 0}
+    with open(yol, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def kontrol_noktasi_yaz(yol: str, durum: dict) -> None:
+    # Yarım yazılmış dosya kalmasın: önce geçici dosyaya yaz, sonra yerine taşı
+    gecici = yol + ".tmp"
+    with open(gecici, "w", encoding="utf-8") as f:
+        json.dump({**durum, "zaman": datetime.now().isoformat(timespec="seconds")}, f, ensure_ascii=False, indent=2)
+    os.replace(gecici, yol)
+
+
+def aday_sorgusu(son_id: int, tumu: bool):
+    """son_id'den sonraki, başlığı/duygusu boş veya varsayılan olan satırlar (id sırasıyla)."""
+    R = models.Ruya
+    sorgu = select(R.id, R.user_id, R.ruya_metni, R.yorum).where(R.id > son_id).order_by(R.id)
+    if not tumu:
+        sorgu = sorgu.where(or_(
+            R.baslik.is_(None), R.baslik == "", R.baslik == VARSAYILAN_BASLIK,
+            R.duygu.is_(None), R.duygu == "", R.duygu == VARSAYILAN_DUYGU,
+        ))
+    return sorgu
+
+
+def _parti_oku(db, son_id: int, tumu: bool, parti: int) -> list:
+    return db.execute(aday_sorgusu(son_id, tumu).limit(parti)).all()
+
+
+def _toplu_guncelle(db, satirlar: list[dict]) -> None:
+    # Birincil anahtarla ORM toplu UPDATE (executemany)
+    db.execute(update(models.Ruya), satirlar)
+    db.commit()
+
+
+class YenidenZenginlestirici:
+    def __init__(self, args):
+        self.args = args
+        self.sinir = asyncio.Semaphore(args.eszamanlilik)
+        self.hiz = HizSiniri(args.hiz)
+        self.asama = Asama(ASAMA_ADI, self._uret, zaman_asimi=args.zaman_asimi, deneme=args.deneme, bekleme=1.0)
+
+    def _model(self):
+        # Her çağrıda alınır: bağlam önbelleğinin süresi uzun işte dolarsa model yeniden kurulur
+        return llm.ozel_model_getir(ASAMA_ADI, YENIDEN_ZENGINLESTIRME_SISTEM_TALIMATI, "free", "baslik_duygu")
+
+    async def _uret(self, baglam: dict) -> dict:
+        await self.hiz.bekle()
+        model = self._model()
+        baslangic = time.perf_counter()
+        try:
+            response = await model.generate_content_async(
+                yeniden_zenginlestirme_prompt(baglam["ruya_metni"], baglam["yorum"]),
+                generation_config={"response_mime_type": "application/json", "response_schema": BASLIK_DUYGU_SEMASI},
+            )
+        except Exception as e:
+            kullanim.kaydet(baglam, ASAMA_ADI, model.model_name, (time.perf_counter() - baslangic) * 1000, "hata")
+            llm.hata_bildir(model, e)
+            raise
+        kullanim.kaydet(baglam, ASAMA_ADI, model.model_name, (time.perf_counter() - baslangic) * 1000, "basarili", response)
+
+        veri = json.loads(response.text)
+        baslik = veri.get("baslik", "").strip().replace('"', '')[:255]
+        duygu = veri.get("duygu", "").strip().replace('.', '')
+        if not baslik or not duygu:
+            raise ValueError("Boş başlık/duygu")
+        return {"baslik": baslik, "duygu": duygu}
+
+    async def satir_isle(self, satir) -> dict | None:
+        baglam = {
+            "user_id": satir.user_id,
+            "yorumcu": VARSAYILAN_YORUMCU,
+            "uyelik": "free",
+            "ruya_metni": satir.ruya_metni,
+            "yorum": satir.yorum,
+        }
+        async with self.sinir:
+            try:
+                sonuc = await asama_calistir(self.asama, baglam)
+            except Exception as e:
+                print(f"⚠️ Rüya {satir.id} zenginleştirilemedi: {e!r}")
+                return None
+        return {"id": satir.id, **sonuc}
+
+    async def calistir(self) -> dict:
+        args = self.args
+        if args.bastan and os.path.exists(args.kontrol_noktasi):
+            os.remove(args.kontrol_noktasi)
+        durum = kontrol_noktasi_oku(args.kontrol_noktasi)
+        print(f"▶️ Başlangıç: id > {durum['son_id']} (önceki: {durum['islenen']} işlendi, {durum['guncellenen']} güncellendi)")
+
+        kalan = args.limit
+        while kalan is None or kalan > 0:
+            parti_boyu = args.parti if kalan is None else min(args.parti, kalan)
+            parti = await db_calistir(_parti_oku, durum["son_id"], args.tumu, parti_boyu)
+            if not parti:
+                break
+            if kalan is not None:
+                kalan -= len(parti)
+
+            baslangic = time.perf_counter()
+            guncellemeler = [g for g in await asyncio.gather(*[self.satir_isle(s) for s in parti]) if g]
+            if guncellemeler and not args.kuru:
+                await db_calistir(_toplu_guncelle, guncellemeler)
+            await kullanim.bosalt()
+
+            durum["son_id"] = parti[-1].id
+            durum["islenen"] += len(parti)
+            durum["guncellenen"] += len(guncellemeler)
+            durum["basarisiz"] += len(parti) - len(guncellemeler)
+            if not args.kuru:
+                kontrol_noktasi_yaz(args.kontrol_noktasi, durum)
+            print(f"📦 {len(parti)} satır, {len(guncellemeler)} güncellendi, son id {durum['son_id']} "
+                  f"({(time.perf_counter() - baslangic):.1f} sn) | toplam {durum['islenen']}")
+
+        print(f"✅ Bitti: {durum['islenen']} işlendi, {durum['guncellenen']} güncellendi, {durum['basarisiz']} başarısız")
+        return durum
+
+
+def argumanlar(argv=None):
+    p = argparse.ArgumentParser(description="Rüya başlık/duygu toplu yeniden zenginleştirme")
+    p.add_argument("--parti", type=int, default=500, help="Parti başına satır")
+    p.add_argument("--eszamanlilik", type=int, default=8, help="Aynı anda en fazla model çağrısı")
+    p.add_argument("--hiz", type=float, default=5, help="Saniyede en fazla model çağrısı (0: sınırsız)")
+    p.add_argument("--zaman-asimi", type=float, default=30, help="Çağrı başına zaman aşımı (sn)")
+    p.add_argument("--deneme", type=int, default=3, help="Satır başına toplam deneme")
+    p.add_argument("--limit", type=int, help="En fazla işlenecek satır (bu çalıştırmada)")
+    p.add_argument("--tumu", action="store_true", help="Varsayılan olmayan başlık/duyguları da yeniden üret")
+    p.add_argument("--kuru", action="store_true", help="Veritabanına ve kontrol noktasına yazma")
+    p.add_argument("--kontrol-noktasi", default=VARSAYILAN_KONTROL_NOKTASI)
+    p.add_argument("--bastan", action="store_true", help="Kontrol noktasını silip baştan başla")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    # Kullanım tablosu henüz yoksa oluştur, şemayı güncelle (main.py ile aynı)
+    models.Base.metadata.create_all(bind=engine)
+    migrasyon.calistir(engine)
+    asyncio.run(YenidenZenginlestirici(argumanlar()).calistir())